@@ -1,9 +1,14 @@
 import fastapi
-from .sensors.controller import router as sensorsRouter
+from .sensors.controller import router as sensorsRouter, publisher, sensor_cache
 from psycopg2 import connect, OperationalError
 import time
 import psycopg2
 from yoyo import get_backend, read_migrations, step
+from shared import mongodb_client as mongodb
+from shared.mongodb_client import MongoDBClient
+from shared.sensors import policies, repository
+from shared.timescale import Timescale, get_pool as get_timescale_pool
+from .views import outdated_views, run_view_script
 
 app = fastapi.FastAPI(title="Senser", version="0.1.0-alpha.1")
 from shared.cassandra_client import CassandraClient
@@ -36,11 +41,11 @@ def execute_view_creation():
     conn = get_real_database_connection()
     try:
         with conn.cursor() as cursor:
-            with open('./views/views_migrations.sql', 'r') as file:
-                sql_commands = file.read().split(';')  
-                for command in sql_commands:
-                    if command.strip():
-                        cursor.execute(command)
+            run_view_script(cursor)
+            # Views of an older version are left as they are, see app/views.py
+            outdated = outdated_views(cursor)
+            if outdated:
+                print(f"Outdated views, upgrade them with 'python -m app.views upgrade': {', '.join(outdated)}")
     finally:
         conn.close()
         
@@ -73,6 +78,18 @@ def apply_migrations():
         execute_view_creation()
     except Exception as e:
         print(f"Error checking views: {e}")
+    try:
+        apply_storage_policies()
+    except Exception as e:
+        print(f"Error applying storage policies: {e}")
+
+def apply_storage_policies():
+    conn = get_real_database_connection()
+    conn.autocommit = False
+    try:
+        policies.apply_policies(Timescale(conn=conn))
+    finally:
+        conn.close()
 
 def create_cassandra():
     cassandra_client = CassandraClient(["cassandra"])
@@ -116,3 +133,49 @@ app.include_router(sensorsRouter)
 def index():
     #Return the api name and version
     return {"name": app.title, "version": app.version}
+
+@app.get("/metrics/publisher")
+def publisher_metrics():
+    # Publish throughput and messages still waiting for a broker confirm
+    return publisher.get_stats()
+
+@app.get("/metrics/timescale")
+def timescale_metrics():
+    # Chunks, compression and policy jobs of the raw readings hypertable
+    with get_timescale_pool().connection() as timescale:
+        return policies.get_storage_stats(timescale)
+
+@app.get("/metrics/sensor-cache")
+def sensor_cache_metrics():
+    # Hits per tier and misses of the sensor records cache
+    return sensor_cache.get_stats()
+
+@app.on_event("startup")
+def listen_sensor_cache_invalidations():
+    try:
+        sensor_cache.start()
+    except Exception as e:
+        print(f"Error subscribing to sensor cache invalidations: {e}")
+
+@app.on_event("startup")
+def prepare_mongodb():
+    mongodb_client = MongoDBClient(host="mongodb")
+    try:
+        repository.ensure_mongodb_indexes(mongodb_client)
+        repository.load_geo_index(mongodb_client)
+    except Exception as e:
+        print(f"Error preparing MongoDB indexes: {e}")
+    finally:
+        mongodb_client.close()
+
+@app.on_event("shutdown")
+def close_publisher():
+    publisher.close()
+
+@app.on_event("shutdown")
+def stop_sensor_cache():
+    sensor_cache.stop()
+
+@app.on_event("shutdown")
+def close_mongodb():
+    mongodb.close_all()
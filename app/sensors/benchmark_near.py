@@ -0,0 +1,67 @@
+import argparse
+import random
+import time
+
+from shared.mongodb_client import MongoDBClient
+from shared.sensors.geoindex import GeoIndex
+
+# Compares the two paths of GET /sensors/near on random sensors around Barcelona:
+#   python -m app.sensors.benchmark_near --sensors 10000 --queries 1000 --radius 2000
+# With --mongo-host the same sensors are written to a scratch collection, queried with
+# $near and the results of both paths are checked to match.
+BENCHMARK_DATABASE = "benchmark"
+BENCHMARK_COLLECTION = "sensors_near"
+
+
+def timed(function, queries):
+    results = []
+    start = time.perf_counter()
+    for query in queries:
+        results.append(function(*query))
+    return (time.perf_counter() - start) / len(queries), results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark of the sensor proximity queries")
+    parser.add_argument("--sensors", type=int, default=10000)
+    parser.add_argument("--queries", type=int, default=1000)
+    parser.add_argument("--radius", type=float, default=2000, help="metres")
+    parser.add_argument("--mongo-host", default=None)
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    sensors = [(i, rng.uniform(41.3, 41.5), rng.uniform(2.0, 2.3)) for i in range(args.sensors)]
+    queries = [(rng.uniform(41.3, 41.5), rng.uniform(2.0, 2.3), args.radius) for _ in range(args.queries)]
+
+    index = GeoIndex()
+    start = time.perf_counter()
+    index.load(sensors)
+    print(f"memory: loaded {len(index)} sensors in {(time.perf_counter() - start) * 1000:.1f} ms")
+    memory_time, memory_results = timed(index.near, queries)
+    print(f"memory: {memory_time * 1e6:.1f} us per query, {sum(map(len, memory_results)) / len(queries):.1f} sensors per result")
+
+    if args.mongo_host is None:
+        return
+    mongodb_client = MongoDBClient(host=args.mongo_host)
+    try:
+        collection = mongodb_client.collection(BENCHMARK_DATABASE, BENCHMARK_COLLECTION)
+        collection.drop()
+        collection.insert_many([{"id": i, "location": {"type": "Point", "coordinates": [lon, lat]}} for i, lat, lon in sensors])
+        collection.create_index([("location", "2dsphere")])
+
+        def mongo_near(latitude, longitude, radius):
+            query = {"location": {"$near": {"$geometry": {"type": "Point", "coordinates": [longitude, latitude]}, "$maxDistance": radius}}}
+            return [doc["id"] for doc in collection.find(query, {"id": 1, "_id": 0})]
+
+        mongo_time, mongo_results = timed(mongo_near, queries)
+        print(f"mongo: {mongo_time * 1e6:.1f} us per query ({mongo_time / memory_time:.0f}x)")
+        # Sensors right on the circle may be in or out on either side
+        mismatches = sum(set(a) ^ set(b) != set() for a, b in zip(memory_results, mongo_results))
+        print(f"results differing between the two paths: {mismatches} of {len(queries)}")
+        collection.drop()
+    finally:
+        mongodb_client.close()
+
+
+if __name__ == "__main__":
+    main()
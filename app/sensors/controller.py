@@ -1,19 +1,26 @@
 import json
+import os
+from contextlib import contextmanager
 
-from fastapi import APIRouter, Depends, HTTPException, Request
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import JSONResponse, StreamingResponse
+from pydantic import ValidationError
 from sqlalchemy.orm import Session
 
 from shared.database import SessionLocal
-from shared.publisher import Publisher
+from shared.publisher import Publisher, PublishError
 from shared.redis_client import RedisClient
 from shared.cassandra_client import CassandraClient
 from shared.mongodb_client import MongoDBClient
 from shared.elasticsearch_client import ElasticsearchClient
 from shared.sensors.repository import DataCommand
-from shared.timescale import Timescale
+from shared.timescale import Timescale, get_pool as get_timescale_pool
 from shared.sensors import repository, schemas
+from shared.sensors.cache import SensorCache
+from .streaming import iter_records
 import json
-from typing import Optional
+from typing import List, Optional
 from collections import defaultdict
 
 def get_db():
@@ -25,11 +32,8 @@ def get_db():
 
 
 def get_timescale():
-    ts = Timescale()
-    try:
+    with get_timescale_pool().connection() as ts:
         yield ts
-    finally:
-        ts.close()
         
 def get_cassandra_client():
     cassandra = CassandraClient(hosts=["cassandra"])
@@ -49,14 +53,55 @@ def get_redis_client():
 # Dependency to get mongodb client
 
 def get_mongodb_client():
-    mongodb = MongoDBClient(host="mongodb")
+    # Wraps the process-wide MongoClient, nothing is opened or closed per request
+    return MongoDBClient(host="mongodb")
+
+# Ingest mode for POST /sensors/{sensor_id}/data:
+# - "sync": the reading is written to Redis, Cassandra and Timescale inside the request.
+# - "async": the reading is published to RabbitMQ and the consumer writes it.
+# INGEST_ASYNC_PERCENT limits the async mode to a share of the sensors (sensor_id % 100)
+# so it can be rolled out gradually.
+INGEST_MODE = os.environ.get("INGEST_MODE", "sync")
+INGEST_ASYNC_PERCENT = int(os.environ.get("INGEST_ASYNC_PERCENT", "100"))
+
+def use_async_ingest(sensor_id: int) -> bool:
+    return INGEST_MODE == "async" and sensor_id % 100 < INGEST_ASYNC_PERCENT
+
+# Readings of the bulk ingest are validated and written in chunks of this size
+BATCH_INGEST_CHUNK_SIZE = int(os.environ.get("BATCH_INGEST_CHUNK_SIZE", "1000"))
+
+@contextmanager
+def ingest_clients():
+    redis = RedisClient(host="redis")
+    cassandra = CassandraClient(hosts=["cassandra"])
     try:
-        yield mongodb
+        with get_timescale_pool().connection() as timescale:
+            yield redis, cassandra, timescale
     finally:
-        mongodb.close()
+        redis.close()
+        cassandra.close()
+
+# Dependency to get the clients used by the sync ingest; the async ingest only publishes,
+# so it does not open any database connection
+
+def get_ingest_clients(sensor_id: int):
+    if use_async_ingest(sensor_id):
+        yield None
+        return
+    with ingest_clients() as clients:
+        yield clients
+
+def get_batch_ingest_clients():
+    if INGEST_MODE == "async" and INGEST_ASYNC_PERCENT >= 100:
+        yield None
+        return
+    with ingest_clients() as clients:
+        yield clients
 
 
 publisher = Publisher()
+# Read-through cache of the sensor records, see shared/sensors/cache.py
+sensor_cache = SensorCache(RedisClient(host="redis"))
 
 router = APIRouter(
     prefix="/sensors",
@@ -73,6 +118,100 @@ def get_sensors_near(latitude: float, longitude: float,radius:int, db: Session =
 
 
 
+# Sensors of a type, from Cassandra. Connecting is only worth it for the requests that
+# select sensors by type, so it is done here rather than in a dependency.
+def sensor_ids_by_type(type: str):
+    cassandra_client = CassandraClient(hosts=["cassandra"])
+    try:
+        return repository.get_sensor_ids_by_type(cassandra_client, type)
+    finally:
+        cassandra_client.close()
+
+# Export of raw readings. The rows are streamed as they are read from a server-side cursor
+# on a connection of its own, held until the export ends or the client goes away.
+def raw_data_response(sensor_ids, from_, to, format):
+    if format not in repository.RAW_EXPORT_FORMATS:
+        raise HTTPException(status_code=400, detail=f"Unsupported format: {format}")
+    # Checked before streaming, afterwards the response status has already been sent
+    try:
+        start = repository._parse_time(from_) if from_ else None
+        end = repository._parse_time(to) if to else None
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid from_ or to")
+
+    def rows():
+        with get_timescale_pool().connection() as timescale:
+            yield from repository.export_raw_data(timescale, sensor_ids, start, end, format)
+
+    return StreamingResponse(rows(), media_type=repository.RAW_EXPORT_FORMATS[format],
+                             headers={"Content-Disposition": f"attachment; filename=sensor_data.{format}"})
+
+@router.get("/data/raw")
+def get_raw_data_export(from_: Optional[str] = None, to: Optional[str] = None, format: str = "ndjson", sensor_ids: Optional[List[int]] = Query(None), type: Optional[str] = None):
+    ids = set(sensor_ids or [])
+    if type is not None:
+        ids.update(sensor_ids_by_type(type))
+    if not ids:
+        raise HTTPException(status_code=400, detail="sensor_ids or type must select at least one sensor")
+    return raw_data_response(sorted(ids), from_, to, format)
+
+
+# Bulk ingest of readings of many sensors, sent as NDJSON or as a JSON array of
+# {"sensor_id": ..., **SensorData} records. The body is parsed as it is received and the
+# readings are checked and written in chunks; invalid records are reported by index.
+@router.post("/data/batch")
+async def record_data_batch(request: Request, db: Session = Depends(get_db), ingest_clients = Depends(get_batch_ingest_clients)):
+    counts = {"recorded": 0, "queued": 0}
+    errors = []
+    chunk = []
+    async for index, record in iter_records(request.stream()):
+        if isinstance(record, Exception):
+            errors.append({"index": index, "detail": str(record)})
+            continue
+        try:
+            chunk.append((index, schemas.SensorDataRecord.parse_obj(record)))
+        except ValidationError as e:
+            errors.append({"index": index, "detail": e.errors()})
+            continue
+        if len(chunk) >= BATCH_INGEST_CHUNK_SIZE:
+            await run_in_threadpool(record_data_chunk, chunk, db, ingest_clients, counts, errors)
+            chunk = []
+    if chunk:
+        await run_in_threadpool(record_data_chunk, chunk, db, ingest_clients, counts, errors)
+    errors.sort(key=lambda error: error["index"])
+    return JSONResponse(status_code=202 if counts["queued"] else 200, content={**counts, "errors": errors})
+
+def record_data_chunk(chunk, db, ingest_clients, counts, errors):
+    existing = repository.get_existing_sensor_ids(db, [record.sensor_id for _, record in chunk])
+    queued = []
+    recorded = []
+    for index, record in chunk:
+        if record.sensor_id not in existing:
+            errors.append({"index": index, "detail": "Sensor not found"})
+        elif use_async_ingest(record.sensor_id):
+            queued.append((index, record.to_message()))
+        else:
+            recorded.append((index, record.to_message()))
+    if queued:
+        try:
+            publisher.publish([message for _, message in queued])
+            counts["queued"] += len(queued)
+        except (PublishError, TimeoutError) as e:
+            print(f"Failed to publish data: {str(e)}")
+            errors.extend({"index": index, "detail": "Failed to queue data"} for index, _ in queued)
+    if recorded:
+        redis_client, cassandra_client, timescale = ingest_clients
+        messages = [message for _, message in recorded]
+        try:
+            repository.record_data_bulk(redis_client, messages)
+            repository.insert_sensor_data_cassandra_bulk(cassandra_client, messages)
+            repository.insert_sensor_data_to_timescale_bulk(messages, timescale)
+            counts["recorded"] += len(recorded)
+        except Exception as e:
+            print(f"Unexpected error: {str(e)}")
+            errors.extend({"index": index, "detail": "Failed to record data"} for index, _ in recorded)
+
+
 # 🙋🏽‍♀️ Add here the route to search sensors by query to Elasticsearch
 # Parameters:
 # - query: string to search
@@ -128,6 +267,28 @@ def get_low_battery_sensors(db: Session = Depends(get_db), cassandra_client: Cas
         raise HTTPException(status_code=500, detail="Failed to retrieve low battery sensor data")
 
 
+# Largest set of sensors accepted by GET /sensors/aggregates
+AGGREGATES_MAX_SENSORS = int(os.environ.get("AGGREGATES_MAX_SENSORS", "1000"))
+
+@router.get("/aggregates")
+def get_aggregates(from_: str, to: str, bucket: str = "day", sensor_ids: Optional[List[int]] = Query(None), type: Optional[str] = None, metrics: Optional[List[str]] = Query(None), timescale: Timescale = Depends(get_timescale)):
+    # Sensors are given as repeated sensor_ids or by type, metrics default to all of them
+    ids = set(sensor_ids or [])
+    if type is not None:
+        ids.update(sensor_ids_by_type(type))
+    if not ids:
+        raise HTTPException(status_code=400, detail="sensor_ids or type must select at least one sensor")
+    if len(ids) > AGGREGATES_MAX_SENSORS:
+        raise HTTPException(status_code=400, detail=f"At most {AGGREGATES_MAX_SENSORS} sensors per request")
+    try:
+        return repository.get_aggregates(timescale, sorted(ids), from_, to, bucket, metrics or list(repository.AGGREGATE_METRICS))
+    except HTTPException as e:
+        raise e
+    except Exception as e:
+        print(f"Unexpected error: {str(e)}")
+        raise HTTPException(status_code=500, detail="Failed to retrieve aggregates")
+
+
 # 🙋🏽‍♀️ Add here the route to get all sensors
 @router.get("")
 def get_sensors(db: Session = Depends(get_db)):
@@ -158,6 +319,7 @@ def create_sensor(sensor: schemas.SensorCreate, db: Session = Depends(get_db), m
         "description": sensor.description,
     }
     repository.insertMongodb(mongodb_client=mongodb_client, sensor_document=sensor_document)
+    sensor_cache.put(repository.sensor_record(newSensor.id, sensor.name, sensor_document))
     sensorIndex = {
         "id": newSensor.id,
         "name": sensor.name,
@@ -171,12 +333,7 @@ def create_sensor(sensor: schemas.SensorCreate, db: Session = Depends(get_db), m
 # 🙋🏽‍♀️ Add here the route to get a sensor by id
 @router.get("/{sensor_id}")
 def get_sensor(sensor_id: int, db: Session = Depends(get_db), mongodb_client: MongoDBClient = Depends(get_mongodb_client)):
-    db_sensor = repository.get_sensor(db, sensor_id)
-    if db_sensor is None:
-        raise HTTPException(status_code=404, detail="Sensor not found")
-    infoSensor = repository.getInfoSensorMDB(mongodb_client, sensor_id)
-    response = {**{"id": db_sensor.id,"name": db_sensor.name}, **(infoSensor)}
-    return response
+    return repository.get_sensor_record(sensor_cache, db, mongodb_client, sensor_id)
 
 # 🙋🏽‍♀️ Add here the route to delete a sensor
 @router.delete("/{sensor_id}")
@@ -184,6 +341,9 @@ def delete_sensor(sensor_id: int, db: Session = Depends(get_db), mongodb_client:
     db_sensor = repository.get_sensor(db, sensor_id)
     if db_sensor is None:
         raise HTTPException(status_code=404, detail="Sensor not found")
+    # Before the primaries, so no replica serves the sensor while it is being deleted, and
+    # again after, for the records loaded in between. invalidate only prints its errors.
+    sensor_cache.invalidate(sensor_id)
     try:
         repository.deleteSensorRedis(redis_client, sensor_id)
     except Exception as e:
@@ -191,12 +351,14 @@ def delete_sensor(sensor_id: int, db: Session = Depends(get_db), mongodb_client:
             status_code=500, detail=f"Error: {str(e)}"
         )
     try:
-        repository.deleteSensorMongodb(mongodb_client, sensor_id, es)
+        repository.deleteSensorMongodb(mongodb_client, sensor_id)
     except Exception as e:
         raise HTTPException(
             status_code=500, detail=f"Failed to delete sensor data in MongoDB: {str(e)}"
         )
-    return repository.delete_sensor(db=db, sensor_id=sensor_id)
+    deleted = repository.delete_sensor(db=db, sensor_id=sensor_id)
+    sensor_cache.invalidate(sensor_id)
+    return deleted
     
  #   return repository.delete_sensor(db=db, sensor_id=sensor_id)
     
@@ -204,9 +366,18 @@ def delete_sensor(sensor_id: int, db: Session = Depends(get_db), mongodb_client:
 
 # 🙋🏽‍♀️ Add here the route to update a sensor
 @router.post("/{sensor_id}/data")
-def record_data(sensor_id: int, data: schemas.SensorData,db: Session = Depends(get_db) ,redis_client: RedisClient = Depends(get_redis_client), cassandra_client: CassandraClient = Depends(get_cassandra_client), timescale: Timescale = Depends(get_timescale)): # timescale: Timescale = Depends(get_timescale)
+def record_data(sensor_id: int, data: schemas.SensorData,db: Session = Depends(get_db), mongodb_client: MongoDBClient = Depends(get_mongodb_client), ingest_clients = Depends(get_ingest_clients)):
     try:
-        repository.get_sensor(db, sensor_id)
+        repository.get_sensor_record(sensor_cache, db, mongodb_client, sensor_id)
+        if ingest_clients is None:
+            # The consumer writes the reading, we only acknowledge that it has been queued
+            try:
+                publisher.publish(schemas.SensorDataMessage(sensor_id=sensor_id, data=data))
+            except (PublishError, TimeoutError) as e:
+                print(f"Failed to publish data: {str(e)}")
+                raise HTTPException(status_code=503, detail="Failed to queue data, try again later")
+            return JSONResponse(status_code=202, content={"message": "Data accepted for processing."})
+        redis_client, cassandra_client, timescale = ingest_clients
         repository.record_data(redis=redis_client, sensor_id=sensor_id, data=data)
         repository.insert_sensor_data_cassandra(cassandra_client, sensor_id, data)
         repository.insert_sensor_data_to_timescale(sensor_id, data, timescale)
@@ -219,20 +390,45 @@ def record_data(sensor_id: int, data: schemas.SensorData,db: Session = Depends(g
     #return repository.record_data(redis=redis_client, sensor_id=sensor_id, data=data)
 
 
+@router.get("/{sensor_id}/data/raw")
+def get_raw_data(sensor_id: int, from_: Optional[str] = None, to: Optional[str] = None, format: str = "ndjson", db: Session = Depends(get_db), mongodb_client: MongoDBClient = Depends(get_mongodb_client)):
+    repository.get_sensor_record(sensor_cache, db, mongodb_client, sensor_id)
+    return raw_data_response([sensor_id], from_, to, format)
+
+
+# Largest number of points of GET /sensors/{sensor_id}/data/series
+SERIES_MAX_POINTS = int(os.environ.get("SERIES_MAX_POINTS", "10000"))
+
+@router.get("/{sensor_id}/data/series")
+def get_data_series(sensor_id: int, metric: str, from_: str, to: str, points: int = Query(1000, ge=3), method: str = "lttb", db: Session = Depends(get_db), mongodb_client: MongoDBClient = Depends(get_mongodb_client), timescale: Timescale = Depends(get_timescale)):
+    repository.get_sensor_record(sensor_cache, db, mongodb_client, sensor_id)
+    if points > SERIES_MAX_POINTS:
+        raise HTTPException(status_code=400, detail=f"At most {SERIES_MAX_POINTS} points")
+    try:
+        return repository.get_series(timescale, sensor_id, metric, from_, to, points, method)
+    except HTTPException as e:
+        raise e
+    except Exception as e:
+        print(f"Unexpected error: {str(e)}")
+        raise HTTPException(status_code=500, detail="Failed to retrieve data series")
+
+
 # 🙋🏽‍♀️ Add here the route to get data from a sensor
 @router.get("/{sensor_id}/data")
-def get_data(sensor_id: int,from_: Optional[str] = None, to: Optional[str] = None, bucket: Optional[str] = None, db: Session = Depends(get_db), redis_client: RedisClient = Depends(get_redis_client), timescale: Timescale = Depends(get_timescale)):    # timescale: Timescale = Depends(get_timescale)
-    db_sensor=repository.get_sensor(db, sensor_id)
+def get_data(sensor_id: int, response: Response, from_: Optional[str] = None, to: Optional[str] = None, bucket: Optional[str] = None, db: Session = Depends(get_db), mongodb_client: MongoDBClient = Depends(get_mongodb_client), redis_client: RedisClient = Depends(get_redis_client), timescale: Timescale = Depends(get_timescale)):    # timescale: Timescale = Depends(get_timescale)
+    sensor = repository.get_sensor_record(sensor_cache, db, mongodb_client, sensor_id)
     try:
         # If aggregation parameters are not provided, retrieve the latest sensor data for redis
         if not from_ or not to or not bucket:
             data = repository.get_data(redis=redis_client, sensor_id=sensor_id)
-            if db_sensor is not None:
-                data["id"] = db_sensor.id
-                data["name"] = db_sensor.name
+            data["id"] = sensor["id"]
+            data["name"] = sensor["name"]
             return data
         # If aggregation parameters are provided, retrieve aggregated data
-        data = repository.get_view_data(sensor_id, from_, to, bucket,timescale)
+        data, watermark = repository.get_view_data(sensor_id, from_, to, bucket,timescale)
+        # Buckets after the watermark are not materialized yet
+        if watermark is not None:
+            response.headers["X-Aggregate-Watermark"] = watermark.isoformat()
         if not data:
             raise HTTPException(status_code=404, detail="No data found for the given parameters")
         return data
@@ -0,0 +1,120 @@
+import codecs
+import json
+
+
+# Incremental parsers for request bodies holding many records, either NDJSON (one JSON
+# object per line) or a JSON array. They consume the body chunk by chunk and yield
+# (index, record) pairs, with a ValueError as record when that one can't be parsed, so the
+# body is never loaded in memory as a whole.
+
+# Longest incomplete record kept while waiting for the rest of it. A longer NDJSON line is
+# reported as invalid and skipped; a longer JSON array element ends the parsing
+MAX_RECORD_CHARS = 64 * 1024
+
+async def iter_records(chunks):
+    decoder = codecs.getincrementaldecoder("utf-8")()
+    buffer = ""
+    parser = None
+    async for chunk in chunks:
+        buffer += decoder.decode(chunk)
+        if parser is None:
+            stripped = buffer.lstrip()
+            if not stripped:
+                continue
+            parser = _JsonArrayParser() if stripped[0] == "[" else _NdjsonParser()
+        buffer, records = parser.feed(buffer, final=False)
+        for record in records:
+            yield record
+    buffer += decoder.decode(b"", final=True)
+    if parser is not None:
+        _, records = parser.feed(buffer, final=True)
+        for record in records:
+            yield record
+
+
+class _NdjsonParser:
+    def __init__(self):
+        self.index = 0
+        # Dropping the rest of a line that was too long
+        self.skipping = False
+
+    def feed(self, buffer, final):
+        if self.skipping:
+            newline = buffer.find("\n")
+            if newline < 0:
+                return "", []
+            buffer = buffer[newline + 1:]
+            self.skipping = False
+        lines = buffer.split("\n")
+        rest = "" if final else lines.pop()
+        records = []
+        for line in lines:
+            if not line.strip():
+                continue
+            try:
+                records.append((self.index, json.loads(line)))
+            except ValueError as e:
+                records.append((self.index, ValueError(f"Invalid JSON: {str(e)}")))
+            self.index += 1
+        if len(rest) > MAX_RECORD_CHARS:
+            records.append((self.index, ValueError(f"Record longer than {MAX_RECORD_CHARS} characters")))
+            self.index += 1
+            self.skipping = True
+            rest = ""
+        return rest, records
+
+
+class _JsonArrayParser:
+    def __init__(self):
+        self.index = 0
+        self.state = "start"
+        self.decoder = json.JSONDecoder()
+
+    def feed(self, buffer, final):
+        records = []
+        pos = 0
+        while self.state != "done":
+            while pos < len(buffer) and buffer[pos].isspace():
+                pos += 1
+            if pos == len(buffer):
+                break
+            if self.state == "start":
+                if buffer[pos] != "[":
+                    records.append((self.index, ValueError("Expected a JSON array")))
+                    self.state = "done"
+                    break
+                pos += 1
+                self.state = "first"
+            elif self.state in ("first", "value"):
+                if self.state == "first" and buffer[pos] == "]":
+                    pos += 1
+                    self.state = "done"
+                    break
+                try:
+                    record, pos = self.decoder.raw_decode(buffer, pos)
+                except ValueError as e:
+                    # Either the element is not complete yet or it is malformed; after a
+                    # malformed element the array can't be parsed any further
+                    if final or len(buffer) - pos > MAX_RECORD_CHARS:
+                        records.append((self.index, ValueError(f"Invalid JSON: {str(e)}")))
+                        self.state = "done"
+                    break
+                records.append((self.index, record))
+                self.index += 1
+                self.state = "separator"
+            elif self.state == "separator":
+                if buffer[pos] == ",":
+                    self.state = "value"
+                elif buffer[pos] == "]":
+                    self.state = "done"
+                else:
+                    records.append((self.index, ValueError("Expected ',' or ']' between records")))
+                    self.state = "done"
+                pos += 1
+        if final and self.state != "done":
+            records.append((self.index, ValueError("Unterminated JSON array")))
+            self.state = "done"
+        if self.state == "done":
+            # Whatever follows the array is ignored
+            return "", records
+        return buffer[pos:], records
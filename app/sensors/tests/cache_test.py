@@ -0,0 +1,143 @@
+import fakeredis
+import pytest
+from shared.redis_client import RedisClient
+from shared.sensors import cache
+from shared.sensors.cache import SensorCache, sensor_cache_key
+
+def make_cache():
+    redis = RedisClient(host="redis")
+    redis._client = fakeredis.FakeRedis()
+    return SensorCache(redis)
+
+def record(sensor_id):
+    return {"id": sensor_id, "name": f"Sensor {sensor_id}", "type": "Temperatura"}
+
+class Loader:
+    def __init__(self, records):
+        self.records = records
+        self.calls = 0
+
+    def __call__(self, sensor_id):
+        self.calls += 1
+        return self.records.get(sensor_id)
+
+class BrokenRedis:
+    def __getattr__(self, name):
+        raise ConnectionError("redis is down")
+
+def test_get_loads_once_then_hits_local():
+    sensor_cache = make_cache()
+    load = Loader({1: record(1)})
+    assert sensor_cache.get(1, load) == record(1)
+    assert sensor_cache.get(1, load) == record(1)
+    assert load.calls == 1
+    stats = sensor_cache.get_stats()
+    assert stats["misses"] == 1
+    assert stats["local_hits"] == 1
+    assert stats["hit_ratio"] == 0.5
+
+def test_get_missing_sensor_is_not_cached():
+    sensor_cache = make_cache()
+    load = Loader({})
+    assert sensor_cache.get(1, load) is None
+    assert sensor_cache.get(1, load) is None
+    assert load.calls == 2
+
+def test_get_hits_redis_from_another_process():
+    sensor_cache = make_cache()
+    other = SensorCache(sensor_cache.redis)
+    sensor_cache.put(record(1))
+    assert other.get(1, Loader({})) == record(1)
+    assert other.get_stats()["redis_hits"] == 1
+
+def test_local_lru_evicts_least_recently_used(monkeypatch):
+    monkeypatch.setattr(cache, "SENSOR_CACHE_SIZE", 2)
+    sensor_cache = make_cache()
+    for sensor_id in (1, 2):
+        sensor_cache.put(record(sensor_id))
+    sensor_cache.get(1, Loader({}))
+    sensor_cache.put(record(3))
+    assert sensor_cache.get_stats()["local_size"] == 2
+    assert sensor_cache._get_local(2) is None
+    assert sensor_cache._get_local(1) == record(1)
+    assert sensor_cache._get_local(3) == record(3)
+
+def test_local_entries_expire(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(cache.time, "monotonic", lambda: now[0])
+    sensor_cache = make_cache()
+    sensor_cache.put(record(1))
+    now[0] += cache.SENSOR_CACHE_TTL + 1
+    assert sensor_cache._get_local(1) is None
+    # Still in Redis
+    assert sensor_cache.get(1, Loader({})) == record(1)
+    assert sensor_cache.get_stats()["redis_hits"] == 1
+
+def test_put_sets_redis_ttl():
+    sensor_cache = make_cache()
+    sensor_cache.put(record(1))
+    ttl = sensor_cache.redis._client.ttl(sensor_cache_key(1))
+    assert 0 < ttl <= cache.SENSOR_CACHE_REDIS_TTL
+
+def test_get_without_redis_falls_back_to_load():
+    sensor_cache = SensorCache(BrokenRedis())
+    load = Loader({1: record(1)})
+    assert sensor_cache.get(1, load) == record(1)
+    assert sensor_cache.get(1, load) == record(1)
+    # The generation cannot be checked, so nothing is cached
+    assert load.calls == 2
+    assert sensor_cache.get_stats()["misses"] == 2
+
+def test_invalidate_forgets_both_tiers():
+    sensor_cache = make_cache()
+    sensor_cache.put(record(1))
+    sensor_cache.invalidate(1)
+    assert sensor_cache.redis.hgetall(sensor_cache_key(1)) == {}
+    assert sensor_cache.get(1, Loader({})) is None
+    assert sensor_cache.get_stats()["invalidations"] == 1
+
+def test_invalidate_without_redis_only_prints():
+    sensor_cache = SensorCache(BrokenRedis())
+    sensor_cache._put_local(1, record(1))
+    sensor_cache.invalidate(1)
+    assert sensor_cache._get_local(1) is None
+
+def test_load_racing_with_invalidate_is_not_cached():
+    sensor_cache = make_cache()
+
+    def load(sensor_id):
+        # The sensor is deleted while its record is being loaded
+        sensor_cache.invalidate(sensor_id)
+        return record(sensor_id)
+
+    assert sensor_cache.get(1, load) == record(1)
+    assert sensor_cache.redis.hgetall(sensor_cache_key(1)) == {}
+    assert sensor_cache._get_local(1) is None
+    assert sensor_cache.get_stats()["stale_loads"] == 1
+
+def test_invalidation_message_drops_local_entries():
+    sensor_cache = make_cache()
+    sensor_cache.put(record(1))
+    sensor_cache.put(record(2))
+    sensor_cache._on_invalidation({"data": b"1"})
+    assert sensor_cache._get_local(1) is None
+    assert sensor_cache._get_local(2) == record(2)
+    sensor_cache._on_invalidation({"data": b"*"})
+    assert sensor_cache.get_stats()["local_size"] == 0
+
+def test_stats_report_listener_state():
+    sensor_cache = make_cache()
+    assert sensor_cache.get_stats()["listening"] is False
+    sensor_cache.start()
+    try:
+        assert sensor_cache.get_stats()["listening"] is True
+    finally:
+        sensor_cache.stop()
+
+def test_stats_report_listener_error():
+    sensor_cache = SensorCache(BrokenRedis())
+    with pytest.raises(ConnectionError):
+        sensor_cache.start()
+    stats = sensor_cache.get_stats()
+    assert stats["listening"] is False
+    assert stats["listener_error"] == "redis is down"
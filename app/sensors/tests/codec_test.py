@@ -0,0 +1,46 @@
+import pytest
+from shared import codec
+from shared.codec import BINARY_CONTENT_TYPE, JSON_CONTENT_TYPE, CodecError
+from shared.sensors.schemas import SensorData, SensorDataMessage
+
+def reading(sensor_id, **values):
+    return SensorDataMessage(sensor_id=sensor_id, data=SensorData(last_seen="2020-01-01T00:00:00.000Z", **values))
+
+READINGS = [
+    reading(1, velocity=1.5, temperature=20.0, humidity=0.4, battery_level=0.9),
+    reading(2, temperature=-3.25),
+    reading(3),
+]
+
+@pytest.mark.parametrize("content_type", [BINARY_CONTENT_TYPE, JSON_CONTENT_TYPE])
+def test_round_trip(content_type):
+    assert codec.decode(codec.encode(READINGS, content_type), content_type) == READINGS
+
+@pytest.mark.parametrize("content_type", [BINARY_CONTENT_TYPE, JSON_CONTENT_TYPE])
+def test_round_trip_single_reading(content_type):
+    assert codec.decode(codec.encode(READINGS[:1], content_type), content_type) == READINGS[:1]
+
+def test_absent_fields_stay_absent():
+    decoded = codec.decode(codec.encode([reading(2, humidity=0.0)]), BINARY_CONTENT_TYPE)[0]
+    assert decoded.data.humidity == 0.0
+    assert decoded.data.velocity is None
+    assert decoded.data.temperature is None
+    assert decoded.data.battery_level is None
+
+def test_binary_is_smaller_than_json():
+    assert len(codec.encode(READINGS, BINARY_CONTENT_TYPE)) < len(codec.encode(READINGS, JSON_CONTENT_TYPE))
+
+def test_largest_sensor_id():
+    readings = [reading(2 ** 32 - 1, temperature=1.0)]
+    assert codec.decode(codec.encode(readings), BINARY_CONTENT_TYPE) == readings
+
+@pytest.mark.parametrize("sensor_id", [2 ** 32, -1])
+def test_sensor_id_out_of_range(sensor_id):
+    with pytest.raises(CodecError):
+        codec.encode([reading(sensor_id)])
+
+def test_unsupported_content_type():
+    with pytest.raises(CodecError):
+        codec.encode(READINGS, "text/plain")
+    with pytest.raises(CodecError):
+        codec.decode(b"", "text/plain")
@@ -0,0 +1,16 @@
+import pytest
+from consumer.__main__ import parse_workers
+from shared.publisher import INGEST_SHARDS
+
+def test_parse_workers():
+    assert parse_workers("redis=1, timescale=2,cassandra") == {"redis": 1, "timescale": 2, "cassandra": 1}
+
+def test_parse_workers_skips_empty_items():
+    assert parse_workers("timescale=2,,") == {"timescale": 2}
+
+def test_parse_workers_caps_to_shards():
+    assert parse_workers(f"timescale={INGEST_SHARDS + 3}") == {"timescale": INGEST_SHARDS}
+
+def test_parse_workers_unknown_sink():
+    with pytest.raises(ValueError):
+        parse_workers("mongodb=1")
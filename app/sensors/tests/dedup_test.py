@@ -0,0 +1,24 @@
+from consumer.dedup import RecentlySeen
+from shared.sensors.schemas import SensorData, SensorDataMessage
+
+def reading(sensor_id, last_seen="2020-01-01T00:00:00.000Z"):
+    return SensorDataMessage(sensor_id=sensor_id, data=SensorData(last_seen=last_seen, temperature=1.0))
+
+def test_unseen_skips_written_and_repeated_readings():
+    recently_seen = RecentlySeen(10)
+    recently_seen.add([reading(1)])
+    fresh = recently_seen.unseen([reading(1), reading(2), reading(2), reading(1, "2020-01-02T00:00:00.000Z")])
+    assert fresh == [reading(2), reading(1, "2020-01-02T00:00:00.000Z")]
+
+def test_unseen_does_not_remember():
+    recently_seen = RecentlySeen(10)
+    assert recently_seen.unseen([reading(1)]) == [reading(1)]
+    assert recently_seen.unseen([reading(1)]) == [reading(1)]
+
+def test_evicts_least_recently_seen():
+    recently_seen = RecentlySeen(2)
+    recently_seen.add([reading(1), reading(2)])
+    # Seeing 1 again makes 2 the oldest
+    assert recently_seen.unseen([reading(1)]) == []
+    recently_seen.add([reading(3)])
+    assert recently_seen.unseen([reading(1), reading(2), reading(3)]) == [reading(2)]
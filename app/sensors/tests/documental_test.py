@@ -17,6 +17,8 @@ def clear_dbs():
     redis = RedisClient(host="redis")
     redis.clearAll()
     redis.close()
+    from app.sensors.controller import sensor_cache
+    sensor_cache.clear()
     mongo = MongoDBClient(host="mongodb")
     mongo.clearDb("sensors")
     mongo.close()
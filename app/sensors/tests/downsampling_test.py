@@ -0,0 +1,37 @@
+import numpy as np
+from shared.sensors.downsampling import minmax
+
+def test_minmax_short_series_keeps_every_point_once():
+    values = np.array([3.0, 1.0, 2.0])
+    indexes, kept = minmax(values, values, 10)
+    assert indexes.tolist() == [0, 1, 2]
+    assert kept.tolist() == [3.0, 1.0, 2.0]
+
+def test_minmax_short_series_of_equal_arrays():
+    indexes, kept = minmax(np.array([3.0, 1.0]), np.array([3.0, 1.0]), 4)
+    assert indexes.tolist() == [0, 1]
+    assert kept.tolist() == [3.0, 1.0]
+
+def test_minmax_short_series_of_aggregates_keeps_low_and_high():
+    indexes, kept = minmax(np.array([1.0, 2.0]), np.array([5.0, 6.0]), 4)
+    assert indexes.tolist() == [0, 0, 1, 1]
+    assert kept.tolist() == [1.0, 5.0, 2.0, 6.0]
+
+def test_minmax_bins_keep_extremes_in_order():
+    values = np.array([5.0, 1.0, 9.0, 4.0, 2.0, 8.0, 7.0, 3.0])
+    indexes, kept = minmax(values, values, 4)
+    assert indexes.tolist() == [1, 2, 4, 5]
+    assert kept.tolist() == [1.0, 9.0, 2.0, 8.0]
+
+def test_minmax_bins_keep_flat_points_once():
+    values = np.array([1.0, 1.0, 1.0, 1.0, 2.0, 9.0, 3.0, 3.0])
+    indexes, kept = minmax(values, values, 4)
+    assert indexes.tolist() == [0, 4, 5]
+    assert kept.tolist() == [1.0, 2.0, 9.0]
+
+def test_minmax_bins_of_aggregates():
+    low = np.array([1.0, 0.0, 2.0, 3.0])
+    high = np.array([4.0, 6.0, 5.0, 9.0])
+    indexes, kept = minmax(low, high, 2)
+    assert indexes.tolist() == [1, 3]
+    assert kept.tolist() == [0.0, 9.0]
@@ -0,0 +1,30 @@
+import math
+import random
+from shared.sensors.geoindex import EARTH_RADIUS, GeoIndex
+
+def haversine(lat1, lon1, lat2, lon2):
+    lat1, lon1, lat2, lon2 = map(math.radians, (lat1, lon1, lat2, lon2))
+    a = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS * math.asin(math.sqrt(a))
+
+def test_near_matches_haversine():
+    rng = random.Random(7)
+    sensors = [(sensor_id, rng.uniform(41.0, 42.0), rng.uniform(1.5, 2.5)) for sensor_id in range(2000)]
+    index = GeoIndex()
+    index.load(sensors)
+    for _ in range(20):
+        lat, lon, radius = rng.uniform(41.0, 42.0), rng.uniform(1.5, 2.5), rng.uniform(100, 20000)
+        distances = {sensor_id: haversine(lat, lon, s_lat, s_lon) for sensor_id, s_lat, s_lon in sensors}
+        expected = sorted((sensor_id for sensor_id, distance in distances.items() if distance <= radius),
+                          key=lambda sensor_id: (distances[sensor_id], sensor_id))
+        assert index.near(lat, lon, radius) == expected
+
+def test_add_and_remove():
+    index = GeoIndex()
+    index.load([(1, 41.3879, 2.16992)])
+    index.add(2, 41.3880, 2.16992)
+    index.add(1, 0.0, 0.0)
+    assert index.near(41.3879, 2.16992, 100) == [2]
+    index.remove(2)
+    assert index.near(41.3879, 2.16992, 100) == []
+    assert len(index) == 1
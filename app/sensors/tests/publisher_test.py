@@ -0,0 +1,20 @@
+from shared.publisher import shard_for
+
+def test_shard_for_is_stable():
+    # Changing these values would send the readings of running sensors to other shards
+    assert [shard_for(sensor_id, 4) for sensor_id in range(12)] == [0, 0, 3, 3, 1, 1, 2, 0, 0, 2, 2, 2]
+    assert [shard_for(sensor_id, 10) for sensor_id in (0, 1, 42, 123456, 2 ** 32 - 1)] == [0, 6, 2, 3, 5]
+
+def test_shard_for_range():
+    for shards in (1, 2, 7, 64):
+        assert {shard_for(sensor_id, shards) for sensor_id in range(2000)} == set(range(shards))
+
+def test_adding_a_shard_only_moves_sensors_to_it():
+    moved = 0
+    for sensor_id in range(10000):
+        before, after = shard_for(sensor_id, 8), shard_for(sensor_id, 9)
+        if before != after:
+            assert after == 8
+            moved += 1
+    # About 1/9 of the sensors
+    assert 800 < moved < 1450
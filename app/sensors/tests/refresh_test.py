@@ -0,0 +1,106 @@
+import threading
+import psycopg2
+from datetime import datetime, timezone
+from shared.sensors import refresh
+
+class FakeTimescale:
+    def __init__(self, mark=None, window=None, failing=None):
+        self.mark = mark
+        self.failing = failing
+        self.window = window
+        self.refreshes = []
+        self.autocommit = []
+
+    def enable_autocommit(self, enabled):
+        self.autocommit.append(enabled)
+
+    def fetch_one(self, query, params=None):
+        if query is refresh.FUNCTION_SCHEMA_QUERY:
+            self.schema_lookups = getattr(self, "schema_lookups", 0) + 1
+            return ("_timescaledb_functions",)
+        if self.failing is not None and self.failing in query:
+            raise psycopg2.errors.UndefinedTable(f"relation {self.failing} does not exist")
+        if query is refresh.STALE_WINDOW_QUERY:
+            return self.window
+        return (self.mark,)
+
+    def execute(self, query, params):
+        self.refreshes.append(params)
+
+def test_ensure_fresh_without_materialized_data(monkeypatch):
+    monkeypatch.setattr(refresh, "AGGREGATE_REFRESH_MODE", "tail")
+    timescale = FakeTimescale()
+    assert refresh.ensure_fresh(timescale, "day", "2020-01-01", "2020-01-02") is None
+    assert timescale.refreshes == []
+    assert timescale.autocommit == [True, False]
+
+def test_ensure_fresh_refreshes_stale_window(monkeypatch):
+    monkeypatch.setattr(refresh, "AGGREGATE_REFRESH_MODE", "tail")
+    monkeypatch.setattr(refresh, "_refreshed", {})
+    mark = datetime(2020, 1, 3, tzinfo=timezone.utc).timestamp()
+    timescale = FakeTimescale(mark=mark, window=("2020-01-01", "2020-01-02"))
+    assert refresh.ensure_fresh(timescale, "day", "2020-01-01", "2020-01-02") == datetime(2020, 1, 3, tzinfo=timezone.utc)
+    assert timescale.refreshes == [("day_aggregates", "2020-01-01", "2020-01-02")]
+
+def test_ensure_fresh_mode_none(monkeypatch):
+    monkeypatch.setattr(refresh, "AGGREGATE_REFRESH_MODE", "none")
+    timescale = FakeTimescale(mark=0.0, window=("2020-01-01", "2020-01-02"))
+    refresh.ensure_fresh(timescale, "day", "2020-01-01", "2020-01-02")
+    assert timescale.refreshes == []
+
+def test_refresh_once_skips_covered_windows(monkeypatch):
+    monkeypatch.setattr(refresh, "_refreshed", {})
+    timescale = FakeTimescale()
+    refresh._refresh_once(timescale, "day_aggregates", 0, 10)
+    refresh._refresh_once(timescale, "day_aggregates", 2, 8)
+    refresh._refresh_once(timescale, "hour_aggregates", 2, 8)
+    refresh._refresh_once(timescale, "day_aggregates", 5, 15)
+    assert timescale.refreshes == [("day_aggregates", 0, 10), ("hour_aggregates", 2, 8), ("day_aggregates", 5, 15)]
+
+def test_refresh_once_waits_for_running_refresh(monkeypatch):
+    monkeypatch.setattr(refresh, "_refreshed", {})
+    started, release = threading.Event(), threading.Event()
+
+    class SlowTimescale(FakeTimescale):
+        def execute(self, query, params):
+            started.set()
+            release.wait(5)
+            super().execute(query, params)
+
+    first, second = SlowTimescale(), FakeTimescale()
+    thread = threading.Thread(target=refresh._refresh_once, args=(first, "day_aggregates", 0, 10))
+    thread.start()
+    started.wait(5)
+    waiter = threading.Thread(target=refresh._refresh_once, args=(second, "day_aggregates", 0, 10))
+    waiter.start()
+    release.set()
+    thread.join(5)
+    waiter.join(5)
+    assert first.refreshes == [("day_aggregates", 0, 10)]
+    assert second.refreshes == []
+
+def test_function_schema_is_looked_up_once(monkeypatch):
+    monkeypatch.setattr(refresh, "_function_schema", None)
+    timescale = FakeTimescale()
+    threads = [threading.Thread(target=refresh.function_schema, args=(timescale,)) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(5)
+    assert refresh.function_schema(timescale) == "_timescaledb_functions"
+    assert timescale.schema_lookups == 1
+
+def test_ensure_fresh_without_invalidation_log(monkeypatch):
+    monkeypatch.setattr(refresh, "AGGREGATE_REFRESH_MODE", "tail")
+    mark = datetime(2020, 1, 3, tzinfo=timezone.utc).timestamp()
+    timescale = FakeTimescale(mark=mark, window=("2020-01-01", "2020-01-02"), failing="invalidation_log")
+    assert refresh.ensure_fresh(timescale, "day", "2020-01-01", "2020-01-02") == datetime(2020, 1, 3, tzinfo=timezone.utc)
+    assert timescale.refreshes == []
+    assert timescale.autocommit == [True, False]
+
+def test_ensure_fresh_without_watermark(monkeypatch):
+    monkeypatch.setattr(refresh, "AGGREGATE_REFRESH_MODE", "tail")
+    monkeypatch.setattr(refresh, "_function_schema", "_timescaledb_functions")
+    timescale = FakeTimescale(mark=0.0, window=("2020-01-01", "2020-01-02"), failing="cagg_watermark")
+    assert refresh.ensure_fresh(timescale, "day", "2020-01-01", "2020-01-02") is None
+    assert timescale.refreshes == []
@@ -0,0 +1,51 @@
+import asyncio
+from app.sensors import streaming
+from app.sensors.streaming import _JsonArrayParser, iter_records
+
+def collect(chunks):
+    async def body():
+        for chunk in chunks:
+            yield chunk
+
+    async def records():
+        return [record async for record in iter_records(body())]
+
+    return asyncio.run(records())
+
+def test_json_array_split_across_chunks():
+    records = collect([b'[{"sensor_id": 1}, {"sen', b'sor_id": 2}]'])
+    assert records == [(0, {"sensor_id": 1}), (1, {"sensor_id": 2})]
+
+def test_ndjson_with_invalid_line():
+    records = collect([b'{"sensor_id": 1}\nnot json\n{"sensor_id": 2}\n'])
+    assert records[0] == (0, {"sensor_id": 1})
+    assert isinstance(records[1][1], ValueError)
+    assert records[2] == (2, {"sensor_id": 2})
+
+def test_json_array_malformed_element_stops_buffering(monkeypatch):
+    monkeypatch.setattr(streaming, "MAX_RECORD_CHARS", 100)
+    parser = _JsonArrayParser()
+    buffer, records = parser.feed('[{"sensor_id": 1}, {"sensor_id": oops}, ', final=False)
+    assert records == [(0, {"sensor_id": 1})]
+    buffer += '{"sensor_id": 3}, ' * 10
+    buffer, records = parser.feed(buffer, final=False)
+    assert buffer == ""
+    assert records[0][0] == 1
+    assert isinstance(records[0][1], ValueError)
+    assert parser.feed('{"sensor_id": 4}]', final=True) == ("", [])
+
+def test_ndjson_long_line_is_skipped(monkeypatch):
+    monkeypatch.setattr(streaming, "MAX_RECORD_CHARS", 100)
+    records = collect([b'{"sensor_id": 1}\n{"sensor_id": ', b'"' + b'x' * 80, b'x' * 80, b'x"}\n{"sensor_id": 3}\n'])
+    assert records[0] == (0, {"sensor_id": 1})
+    assert records[1][0] == 1
+    assert isinstance(records[1][1], ValueError)
+    assert records[2] == (2, {"sensor_id": 3})
+
+def test_ndjson_parser_does_not_buffer_long_lines(monkeypatch):
+    monkeypatch.setattr(streaming, "MAX_RECORD_CHARS", 100)
+    parser = streaming._NdjsonParser()
+    rest, records = parser.feed("x" * 150, final=False)
+    assert rest == ""
+    assert len(records) == 1
+    assert parser.feed("x" * 150, final=False) == ("", [])
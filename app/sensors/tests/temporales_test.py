@@ -19,6 +19,8 @@ def clear_dbs():
     redis = RedisClient(host="redis")
     redis.clearAll()
     redis.close()
+    from app.sensors.controller import sensor_cache
+    sensor_cache.clear()
     mongo = MongoDBClient(host="mongodb")
     mongo.clearDb("sensors")
     mongo.close()
@@ -133,6 +135,37 @@ def test_get_sensor_data_3_month():
     assert response.status_code == 200
     json = response.json()
     assert len(json) == 1
+
+
+def test_get_aggregates_day():
+    response = client.get("/sensors/aggregates?sensor_ids=1&sensor_ids=2&from_=2020-01-01T00:00:00.000Z&to=2020-01-03T00:00:00.000Z&bucket=day&metrics=temperature")
+    assert response.status_code == 200
+    json = response.json()
+    assert json["sensor_id"] == [1, 1, 1, 2]
+    assert json["temperature"]["max"] == [1.0, 15.0, 18.0, None]
+    assert json["temperature"]["count"] == [1, 1, 1, 0]
+
+
+def test_get_sensor_data_2_raw():
+    response = client.get("/sensors/2/data/raw?from_=2020-01-01T00:00:00.000Z&to=2020-01-01T02:00:00.000Z&format=csv")
+    assert response.status_code == 200
+    lines = response.text.splitlines()
+    assert lines[0] == "sensor_id,last_seen,velocity,temperature,humidity,battery_level"
+    assert len(lines) == 4
+
+
+def test_get_raw_data_invalid_from():
+    response = client.get("/sensors/data/raw?sensor_ids=2&from_=yesterday")
+    assert response.status_code == 400
+    assert "Invalid from_ or to" in response.text
+
+
+def test_get_sensor_data_2_series():
+    response = client.get("/sensors/2/data/series?metric=velocity&from_=2020-01-01T00:00:00.000Z&to=2020-01-01T02:00:00.000Z&points=1000")
+    assert response.status_code == 200
+    json = response.json()
+    assert json["source"] == "sensor_data"
+    assert json["value"] == [1.0, 15.0, 18.0]
     
 def test_post_sensor_data_not_exists():
     response = client.post("/sensors/4/data", json={"temperature": 1.0, "humidity": 1.0, "battery_level": 1.0, "last_seen": "2020-01-01T00:00:00.000Z"})
@@ -142,4 +175,23 @@ def test_post_sensor_data_not_exists():
 def test_get_sensor_data_not_exists():
     response = client.get("/sensors/4/data")
     assert response.status_code == 404
-    assert "Sensor not found" in response.text
\ No newline at end of file
+    assert "Sensor not found" in response.text
+
+
+def test_post_sensor_data_batch(monkeypatch):
+    # Readings written by the API itself, so they can be read back right away
+    from app.sensors import controller
+    monkeypatch.setattr(controller, "INGEST_MODE", "sync")
+    body = "\n".join([
+        '{"sensor_id": 1, "temperature": 20.0, "humidity": 1.0, "battery_level": 0.8, "last_seen": "2020-01-04T00:00:00.000Z"}',
+        '{"sensor_id": 4, "temperature": 1.0, "humidity": 1.0, "battery_level": 1.0, "last_seen": "2020-01-04T00:00:00.000Z"}',
+        '{"sensor_id": 1, "temperature": 20.0}',
+    ])
+    response = client.post("/sensors/data/batch", content=body, headers={"Content-Type": "application/x-ndjson"})
+    assert response.status_code == 200
+    json = response.json()
+    assert json["recorded"] == 1
+    assert [error["index"] for error in json["errors"]] == [1, 2]
+    response = client.get("/sensors/1/data")
+    assert response.status_code == 200
+    assert response.json()["last_seen"] == "2020-01-04T00:00:00.000Z"
@@ -0,0 +1,54 @@
+import psycopg2
+import pytest
+from app.views import outdated_views, run_view_script, upgrade_view
+from shared.timescale import connection_kwargs
+
+# week_aggregates as created by the views script before the min/max/count/last columns
+OLD_WEEK_AGGREGATES = """
+    CREATE MATERIALIZED VIEW week_aggregates
+    WITH (timescaledb.continuous) AS
+    SELECT
+      sensor_id,
+      time_bucket('1 week', last_seen) AS week,
+      AVG(velocity) AS avg_velocity,
+      AVG(temperature) AS avg_temperature,
+      AVG(humidity) AS avg_humidity,
+      AVG(battery_level) AS avg_battery
+    FROM
+      sensor_data
+    GROUP BY
+      sensor_id, week"""
+
+SENSOR_ID = 9999
+
+@pytest.fixture()
+def conn():
+    from app.main import apply_migrations
+    apply_migrations()
+    conn = psycopg2.connect(**connection_kwargs())
+    conn.autocommit = True
+    with conn.cursor() as cursor:
+        # At the start of its week bucket, so the raw readings cover the whole bucket
+        cursor.execute("INSERT INTO sensor_data (sensor_id, temperature, battery_level, last_seen) "
+                       "VALUES (%s, 20.0, 0.5, '2020-01-06T00:00:00Z') ON CONFLICT DO NOTHING", (SENSOR_ID,))
+        cursor.execute("DROP MATERIALIZED VIEW week_aggregates")
+        cursor.execute(OLD_WEEK_AGGREGATES)
+        cursor.execute("CALL refresh_continuous_aggregate('week_aggregates', NULL, NULL)")
+    conn.autocommit = False
+    yield conn
+    conn.rollback()
+    conn.autocommit = True
+    with conn.cursor() as cursor:
+        cursor.execute("DELETE FROM sensor_data WHERE sensor_id = %s", (SENSOR_ID,))
+        run_view_script(cursor)
+    conn.close()
+
+def test_upgrade_view_from_old_script(conn):
+    with conn.cursor() as cursor:
+        assert "week_aggregates" in outdated_views(cursor)
+    assert upgrade_view(conn, "week_aggregates")
+    with conn.cursor() as cursor:
+        assert "week_aggregates" not in outdated_views(cursor)
+        cursor.execute("SELECT max_temperature, last_battery FROM week_aggregates WHERE sensor_id = %s", (SENSOR_ID,))
+        assert cursor.fetchall() == [(20.0, 0.5)]
+    conn.rollback()
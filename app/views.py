@@ -0,0 +1,117 @@
+import argparse
+import re
+
+import psycopg2
+
+from shared.timescale import connection_kwargs
+
+# Continuous aggregates of views/views_migrations.sql. The script creates missing views,
+# sets their options and policies, and runs at every API start. Views created by an older
+# version of the script are not changed by it: they are upgraded explicitly with
+#   python -m app.views upgrade
+# which builds the new definition under {view}_v2, backfills it from the raw readings and
+# swaps it in. A view is only upgraded while the raw readings still cover all its buckets,
+# so no aggregate history older than the retention of sensor_data is lost.
+VIEW_SCRIPT = './views/views_migrations.sql'
+VIEW_NAMES = ['hour_aggregates', 'day_aggregates', 'week_aggregates', 'month_aggregates', 'year_aggregates']
+# Column added by the latest version of the views
+LATEST_COLUMN = 'last_battery'
+
+OUTDATED_VIEWS_QUERY = """
+    SELECT view_name FROM timescaledb_information.continuous_aggregates c
+    WHERE view_name = ANY(%s)
+      AND NOT EXISTS (SELECT 1 FROM information_schema.columns
+                      WHERE table_name = c.view_name AND column_name = %s)"""
+
+OLDEST_RAW_CHUNK_QUERY = """
+    SELECT min(range_start) FROM timescaledb_information.chunks
+    WHERE hypertable_name = 'sensor_data'"""
+
+
+def view_statements():
+    with open(VIEW_SCRIPT, 'r') as file:
+        return [command for command in file.read().split(';') if command.strip()]
+
+
+def run_view_script(cursor):
+    for command in view_statements():
+        cursor.execute(command)
+
+
+def outdated_views(cursor):
+    cursor.execute(OUTDATED_VIEWS_QUERY, (VIEW_NAMES, LATEST_COLUMN))
+    return [row[0] for row in cursor.fetchall()]
+
+
+def view_definition(view_name, new_name):
+    """ CREATE statement of the view in the script, for a view called new_name and
+    without data. """
+    header = f"CREATE MATERIALIZED VIEW IF NOT EXISTS {view_name}\n"
+    for command in view_statements():
+        if header in command:
+            body = command[command.index(header) + len(header):]
+            return f"CREATE MATERIALIZED VIEW {new_name}\n{body.rstrip()}\nWITH NO DATA"
+    raise ValueError(f"{view_name} is not defined in {VIEW_SCRIPT}")
+
+
+def covered_by_raw_data(cursor, view_name):
+    """ Whether the raw readings still reach back to the oldest bucket of the view. """
+    bucket = view_name[:-len('_aggregates')]
+    cursor.execute(f"SELECT min({bucket}) FROM {view_name}")
+    oldest_bucket = cursor.fetchone()[0]
+    if oldest_bucket is None:
+        return True
+    cursor.execute(OLDEST_RAW_CHUNK_QUERY)
+    oldest_chunk = cursor.fetchone()[0]
+    return oldest_chunk is not None and oldest_chunk <= oldest_bucket
+
+
+def upgrade_view(conn, view_name):
+    new_name = f"{view_name}_v2"
+    with conn.cursor() as cursor:
+        covered = covered_by_raw_data(cursor, view_name)
+        # End the transaction of the check, autocommit can't be switched on inside one
+        conn.rollback()
+        if not covered:
+            print(f"{view_name} has buckets older than the raw readings, not upgraded: "
+                  f"rebuilding it would lose them")
+            return False
+        # Backfill outside of a transaction, refresh_continuous_aggregate requires it
+        conn.autocommit = True
+        cursor.execute(f"DROP MATERIALIZED VIEW IF EXISTS {new_name}")
+        cursor.execute(view_definition(view_name, new_name))
+        cursor.execute("CALL refresh_continuous_aggregate(%s, NULL, NULL)", (new_name,))
+        # Swap, readers see either the old or the new view
+        conn.autocommit = False
+        cursor.execute(f"DROP MATERIALIZED VIEW {view_name}")
+        cursor.execute(f"ALTER MATERIALIZED VIEW {new_name} RENAME TO {view_name}")
+        conn.commit()
+    print(f"{view_name} upgraded")
+    return True
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Continuous aggregates of the sensor readings")
+    parser.add_argument("command", choices=["status", "upgrade"])
+    args = parser.parse_args()
+
+    conn = psycopg2.connect(**connection_kwargs())
+    try:
+        with conn.cursor() as cursor:
+            outdated = outdated_views(cursor)
+        conn.commit()
+        if args.command == "status":
+            print(f"Outdated views: {', '.join(outdated) or 'none'}")
+            return
+        for view_name in outdated:
+            upgrade_view(conn, view_name)
+        # Options and policies of the upgraded views
+        conn.autocommit = True
+        with conn.cursor() as cursor:
+            run_view_script(cursor)
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,113 @@
+import argparse
+import logging
+import multiprocessing
+import os
+import signal
+import time
+
+from consumer.main import CONSUMER_LOG_LEVEL, run
+from consumer.sinks import SINKS
+from shared.publisher import INGEST_SHARDS
+
+# Worker processes per sink, e.g. "redis=1,timescale=4,cassandra=2"; sinks left out get none.
+# The INGEST_SHARDS shards of a sink are split between its workers, so there are at most
+# INGEST_SHARDS workers per sink.
+CONSUMER_WORKERS = os.environ.get("CONSUMER_WORKERS", ",".join(f"{sink}=1" for sink in SINKS))
+# Seconds the workers get to flush their in-flight batch after SIGTERM before being killed
+CONSUMER_DRAIN_TIMEOUT = float(os.environ.get("CONSUMER_DRAIN_TIMEOUT", "30"))
+# A worker that dies sooner than this after starting is restarted with an exponential backoff
+MIN_HEALTHY_UPTIME = 10
+MAX_RESTART_DELAY = 60
+
+
+def parse_workers(spec):
+    workers = {}
+    for item in spec.split(","):
+        if not item.strip():
+            continue
+        sink, _, count = item.partition("=")
+        sink = sink.strip()
+        if sink not in SINKS:
+            raise ValueError(f"Unknown sink: {sink}")
+        workers[sink] = int(count or 1)
+        if workers[sink] > INGEST_SHARDS:
+            print(f"Only {INGEST_SHARDS} shards to consume, running {INGEST_SHARDS} {sink} workers")
+            workers[sink] = INGEST_SHARDS
+    return workers
+
+
+class Supervisor:
+    """ Runs one process per worker slot, each with its own RabbitMQ connection and prefetch,
+    restarts the ones that crash and drains them all on SIGTERM. """
+
+    def __init__(self, workers):
+        self.workers = workers
+        self.slots = [(sink, index) for sink, count in workers.items() for index in range(count)]
+        self.processes = {}
+        self.started_at = {}
+        self.restart_at = {}
+        self.restart_delay = {slot: 1 for slot in self.slots}
+        self.stopping = False
+
+    def start(self, slot):
+        sink, index = slot
+        # A slot always owns the same shards, so a restarted worker takes over its shards
+        shards = [shard for shard in range(INGEST_SHARDS) if shard % self.workers[sink] == index]
+        process = multiprocessing.Process(target=run, args=(sink, shards), name=f"consumer-{sink}-{index}")
+        process.start()
+        self.processes[slot] = process
+        self.started_at[slot] = time.monotonic()
+        print(f"Started {process.name} (pid {process.pid}) on shards {shards}")
+
+    def stop(self, signum=None, frame=None):
+        self.stopping = True
+
+    def run(self):
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+        for slot in self.slots:
+            self.start(slot)
+        while not self.stopping:
+            time.sleep(0.5)
+            now = time.monotonic()
+            for slot, process in list(self.processes.items()):
+                if process.is_alive() or slot in self.restart_at:
+                    continue
+                uptime = now - self.started_at[slot]
+                if uptime >= MIN_HEALTHY_UPTIME:
+                    self.restart_delay[slot] = 1
+                delay = self.restart_delay[slot]
+                self.restart_delay[slot] = min(delay * 2, MAX_RESTART_DELAY)
+                self.restart_at[slot] = now + delay
+                print(f"{process.name} exited with code {process.exitcode}, restarting in {delay}s")
+            for slot, restart_at in list(self.restart_at.items()):
+                if restart_at <= now and not self.stopping:
+                    del self.restart_at[slot]
+                    self.start(slot)
+        self.drain()
+
+    def drain(self):
+        print("Stopping consumers, draining in-flight batches")
+        for process in self.processes.values():
+            if process.is_alive():
+                process.terminate()
+        deadline = time.monotonic() + CONSUMER_DRAIN_TIMEOUT
+        for process in self.processes.values():
+            process.join(timeout=max(deadline - time.monotonic(), 0))
+            if process.is_alive():
+                print(f"{process.name} did not drain in time, killing it")
+                process.kill()
+                process.join()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the sensor data consumers")
+    parser.add_argument("--workers", default=CONSUMER_WORKERS,
+                        help="worker processes per sink, e.g. redis=1,timescale=4,cassandra=2")
+    args = parser.parse_args()
+    logging.basicConfig(level=CONSUMER_LOG_LEVEL)
+    Supervisor(parse_workers(args.workers)).run()
+
+
+if __name__ == "__main__":
+    main()
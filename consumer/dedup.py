@@ -0,0 +1,34 @@
+from collections import OrderedDict
+
+
+class RecentlySeen:
+    """ LRU of the (sensor_id, last_seen) pairs a sink has already written. Redelivered
+    readings are dropped before reaching the databases; the writes themselves are
+    idempotent too, this only saves the round trips. """
+
+    def __init__(self, maxsize=100000):
+        self.maxsize = maxsize
+        self._seen = OrderedDict()
+
+    @staticmethod
+    def _key(message):
+        return message.sensor_id, message.data.last_seen
+
+    def unseen(self, messages):
+        # Readings not written yet, each one once even if it is repeated in the batch
+        fresh = {}
+        for message in messages:
+            key = self._key(message)
+            if key in self._seen:
+                self._seen.move_to_end(key)
+            elif key not in fresh:
+                fresh[key] = message
+        return list(fresh.values())
+
+    def add(self, messages):
+        # Only called once the readings are written, a failed batch must be retried
+        for message in messages:
+            self._seen[self._key(message)] = None
+            self._seen.move_to_end(self._key(message))
+        while len(self._seen) > self.maxsize:
+            self._seen.popitem(last=False)
@@ -1,13 +1,59 @@
-import json
+import logging
+import os
+import signal
+import sys
 
+from consumer.dedup import RecentlySeen
+from consumer.sinks import SINKS
+from shared.publisher import INGEST_SHARDS, shard_queue
 from shared.subscriber import Subscriber
 
-subscriber = Subscriber()
+# Batches are flushed when they reach CONSUMER_BATCH_SIZE messages or CONSUMER_BATCH_TIMEOUT
+# seconds after their first message, whatever comes first
+CONSUMER_BATCH_SIZE = int(os.environ.get("CONSUMER_BATCH_SIZE", "500"))
+CONSUMER_BATCH_TIMEOUT = float(os.environ.get("CONSUMER_BATCH_TIMEOUT", "1.0"))
+CONSUMER_PREFETCH = int(os.environ.get("CONSUMER_PREFETCH", str(2 * CONSUMER_BATCH_SIZE)))
+# Number of recently written readings remembered to skip redeliveries
+CONSUMER_DEDUP_SIZE = int(os.environ.get("CONSUMER_DEDUP_SIZE", "100000"))
+# Per-batch logs are at DEBUG level
+CONSUMER_LOG_LEVEL = os.environ.get("CONSUMER_LOG_LEVEL", "INFO")
 
+logger = logging.getLogger(__name__)
 
-def callback(ch, method, properties, body):
-    data = json.loads(body)
-    print("Received data:", data)
 
+def run(sink_name, shards=None):
+    # The worker consumes the given shards of the sink queue, all of them by default
+    shards = range(INGEST_SHARDS) if shards is None else shards
+    queues = [shard_queue(sink_name, shard) for shard in shards]
+    sink = SINKS[sink_name]()
+    subscriber = Subscriber()
+    # SIGTERM (docker stop, the supervisor) and Ctrl-C drain the batch in progress before exiting
+    signal.signal(signal.SIGTERM, lambda signum, frame: subscriber.stop())
+    signal.signal(signal.SIGINT, lambda signum, frame: subscriber.stop())
+    recently_seen = RecentlySeen(CONSUMER_DEDUP_SIZE)
 
-subscriber.subscribe(callback)
+    def flush(messages):
+        # Raising here makes the subscriber requeue the whole batch, which is safe
+        # because every sink write is idempotent
+        fresh = recently_seen.unseen(messages)
+        if fresh:
+            sink.flush(fresh)
+            recently_seen.add(fresh)
+        logger.debug("[%s] Flushed batch of %d readings, skipped %d already written",
+                     sink_name, len(fresh), len(messages) - len(fresh))
+
+    try:
+        subscriber.consume_batches(queues, flush, batch_size=CONSUMER_BATCH_SIZE, batch_timeout=CONSUMER_BATCH_TIMEOUT, prefetch=CONSUMER_PREFETCH)
+    finally:
+        subscriber.close()
+        sink.close()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=CONSUMER_LOG_LEVEL)
+    # The sink is given as the first argument or with CONSUMER_SINK: redis, timescale or
+    # cassandra, optionally followed by the shards to consume
+    sink_name = sys.argv[1] if len(sys.argv) > 1 else os.environ.get("CONSUMER_SINK")
+    if sink_name not in SINKS:
+        sys.exit(f"Usage: python consumer/main.py [{'|'.join(SINKS)}] [shard ...]")
+    run(sink_name, [int(shard) for shard in sys.argv[2:]] or None)
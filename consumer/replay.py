@@ -0,0 +1,38 @@
+import argparse
+
+from shared.publisher import SINKS, dead_letter_queue, legacy_sink_queue, sink_queues
+from shared.subscriber import Subscriber
+
+
+def main():
+    # Moves the messages parked after RETRY_MAX_ATTEMPTS failed writes back to their sink
+    # queue, e.g. once the store that rejected them is healthy again:
+    #   python -m consumer.replay timescale --limit 1000
+    # With --legacy, moves the readings left in the queue of the sink from before sharding
+    # to its shard queues instead.
+    parser = argparse.ArgumentParser(description="Replay dead-lettered sensor readings")
+    parser.add_argument("sink", choices=SINKS)
+    parser.add_argument("--limit", type=int, default=None, help="maximum number of messages to replay, by default those parked when the replay starts")
+    parser.add_argument("--legacy", action="store_true", help="move the readings of the pre-shard queue to the shards")
+    args = parser.parse_args()
+
+    subscriber = Subscriber()
+    try:
+        if args.legacy:
+            moved = subscriber.move_legacy_messages(args.sink)
+            print(f"Moved {moved} messages from {legacy_sink_queue(args.sink)} to the shards")
+            return
+        remaining = args.limit
+        for queue in sink_queues(args.sink):
+            moved = subscriber.replay_dead_letters(queue, limit=remaining)
+            print(f"Replayed {moved} messages from {dead_letter_queue(queue)} to {queue}")
+            if remaining is not None:
+                remaining -= moved
+                if remaining <= 0:
+                    break
+    finally:
+        subscriber.close()
+
+
+if __name__ == "__main__":
+    main()
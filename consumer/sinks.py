@@ -0,0 +1,52 @@
+from shared.cassandra_client import CassandraClient
+from shared.redis_client import RedisClient
+from shared.sensors import repository
+from shared.timescale import Timescale
+
+
+# Each sink consumes its own queue and owns the client of the store it writes to,
+# so the workers of a sink can be scaled or slowed down without affecting the others
+
+class RedisSink:
+    name = "redis"
+
+    def __init__(self):
+        self.client = RedisClient(host="redis")
+
+    def flush(self, messages):
+        # Latest value of each sensor, read by GET /sensors/{sensor_id}/data
+        repository.record_data_bulk(self.client, messages)
+
+    def close(self):
+        self.client.close()
+
+
+class TimescaleSink:
+    name = "timescale"
+
+    def __init__(self):
+        self.client = Timescale()
+
+    def flush(self, messages):
+        # History of the readings, aggregated by the continuous aggregates
+        repository.insert_sensor_data_to_timescale_bulk(messages, self.client)
+
+    def close(self):
+        self.client.close()
+
+
+class CassandraSink:
+    name = "cassandra"
+
+    def __init__(self):
+        self.client = CassandraClient(hosts=["cassandra"])
+
+    def flush(self, messages):
+        # Temperature, battery and sensor type aggregates
+        repository.insert_sensor_data_cassandra_bulk(self.client, messages)
+
+    def close(self):
+        self.client.close()
+
+
+SINKS = {sink.name: sink for sink in (RedisSink, TimescaleSink, CassandraSink)}
@@ -0,0 +1,22 @@
+-- depends: migrations_ts
+
+-- One chunk per day of readings: recent chunks and their indexes stay in memory at our
+-- ingest rate, and compression and retention work on whole days.
+-- TS_CHUNK_TIME_INTERVAL overrides it at startup (shared/sensors/policies.py).
+SELECT set_chunk_time_interval('sensor_data', INTERVAL '1 day');
+
+-- Native compression, one segment per sensor ordered by time so reads of a sensor over a
+-- time range only decompress its own segments. The compression and retention policies
+-- are applied at startup from the TS_COMPRESS_AFTER and TS_RETENTION_AFTER variables.
+DO $$
+BEGIN
+    IF NOT EXISTS (SELECT 1 FROM timescaledb_information.hypertables
+                   WHERE hypertable_name = 'sensor_data' AND compression_enabled) THEN
+        ALTER TABLE sensor_data SET (
+            timescaledb.compress,
+            timescaledb.compress_segmentby = 'sensor_id',
+            timescaledb.compress_orderby = 'last_seen DESC'
+        );
+    END IF;
+END
+$$;
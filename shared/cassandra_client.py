@@ -1,10 +1,12 @@
 from cassandra.cluster import Cluster
+from cassandra.query import BatchStatement, BatchType
 from cassandra.policies import TokenAwarePolicy, DCAwareRoundRobinPolicy
 
 class CassandraClient:
     def __init__(self, hosts):
         self.cluster = Cluster(hosts, load_balancing_policy=TokenAwarePolicy(DCAwareRoundRobinPolicy()),protocol_version=4)
         self.session = self.cluster.connect()
+        self.prepared = {}
 
     def get_session(self):
         return self.session
@@ -17,3 +19,21 @@ class CassandraClient:
             return self.get_session().execute(query, parameters)
         else:
             return self.get_session().execute(query)
+
+
+    def prepare(self, query):
+        # Prepared statements are cached per client so they are only prepared once per session
+        if query not in self.prepared:
+            self.prepared[query] = self.get_session().prepare(query)
+        return self.prepared[query]
+
+    def execute_batch(self, statements, batch_size=100):
+        """ Execute (query, parameters) pairs as unlogged batches sent concurrently. """
+        futures = []
+        for start in range(0, len(statements), batch_size):
+            batch = BatchStatement(batch_type=BatchType.UNLOGGED)
+            for query, parameters in statements[start:start + batch_size]:
+                batch.add(self.prepare(query), parameters)
+            futures.append(self.get_session().execute_async(batch))
+        for future in futures:
+            future.result()
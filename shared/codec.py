@@ -0,0 +1,89 @@
+import json
+import struct
+from typing import List
+
+from shared.sensors import schemas
+
+# Wire formats of the sensor readings published to RabbitMQ, told apart by the
+# content_type property of the message. Messages without content_type are JSON, so
+# producers that still publish SensorDataMessage.to_json() keep working.
+JSON_CONTENT_TYPE = "application/json"
+BINARY_CONTENT_TYPE = "application/x-sensor-readings"
+
+# Binary layout, little endian:
+#   message: version (B), number of readings (H), readings...
+#   reading: sensor_id (I), presence bitmap (B), length of last_seen (B),
+#            one double per optional field present in the bitmap, last_seen (UTF-8)
+BINARY_VERSION = 1
+OPTIONAL_FIELDS = ("velocity", "temperature", "humidity", "battery_level")
+MAX_READINGS_PER_MESSAGE = 0xFFFF
+
+_HEADER = struct.Struct("<BH")
+_RECORD = struct.Struct("<IBB")
+# One precompiled struct per presence bitmap, packing only the fields that are present
+_VALUES = [struct.Struct("<" + "d" * bin(bitmap).count("1")) for bitmap in range(1 << len(OPTIONAL_FIELDS))]
+
+
+class CodecError(ValueError):
+    pass
+
+
+def encode(messages: List[schemas.SensorDataMessage], content_type: str = BINARY_CONTENT_TYPE) -> bytes:
+    if content_type == JSON_CONTENT_TYPE:
+        if len(messages) == 1:
+            return messages[0].to_json().encode()
+        return json.dumps([message.dict() for message in messages]).encode()
+    if content_type != BINARY_CONTENT_TYPE:
+        raise CodecError(f"Unsupported content type: {content_type}")
+    if len(messages) > MAX_READINGS_PER_MESSAGE:
+        raise CodecError(f"At most {MAX_READINGS_PER_MESSAGE} readings fit in a message")
+    parts = [_HEADER.pack(BINARY_VERSION, len(messages))]
+    for message in messages:
+        data = message.data
+        values = []
+        bitmap = 0
+        for bit, field in enumerate(OPTIONAL_FIELDS):
+            value = getattr(data, field)
+            if value is not None:
+                bitmap |= 1 << bit
+                values.append(value)
+        last_seen = data.last_seen.encode()
+        try:
+            parts.append(_RECORD.pack(message.sensor_id, bitmap, len(last_seen)))
+        except struct.error:
+            raise CodecError(f"Sensor id {message.sensor_id} or last_seen {data.last_seen!r} out of range")
+        parts.append(_VALUES[bitmap].pack(*values))
+        parts.append(last_seen)
+    return b"".join(parts)
+
+
+def decode(body: bytes, content_type: str = None) -> List[schemas.SensorDataMessage]:
+    if content_type in (None, JSON_CONTENT_TYPE):
+        payload = json.loads(body)
+        if isinstance(payload, list):
+            return [schemas.SensorDataMessage.parse_obj(item) for item in payload]
+        return [schemas.SensorDataMessage.parse_obj(payload)]
+    if content_type != BINARY_CONTENT_TYPE:
+        raise CodecError(f"Unsupported content type: {content_type}")
+    try:
+        version, count = _HEADER.unpack_from(body, 0)
+        if version != BINARY_VERSION:
+            raise CodecError(f"Unsupported binary version: {version}")
+        offset = _HEADER.size
+        messages = []
+        for _ in range(count):
+            sensor_id, bitmap, length = _RECORD.unpack_from(body, offset)
+            offset += _RECORD.size
+            values = iter(_VALUES[bitmap].unpack_from(body, offset))
+            offset += _VALUES[bitmap].size
+            last_seen = body[offset:offset + length].decode()
+            offset += length
+            fields = {field: next(values) if bitmap & (1 << bit) else None for bit, field in enumerate(OPTIONAL_FIELDS)}
+            # The producer already validated the reading, skip pydantic validation on the hot path
+            data = schemas.SensorData.construct(last_seen=last_seen, **fields)
+            messages.append(schemas.SensorDataMessage.construct(sensor_id=sensor_id, data=data))
+    except (struct.error, UnicodeDecodeError) as e:
+        raise CodecError(f"Malformed sensor readings message: {str(e)}")
+    if offset != len(body):
+        raise CodecError("Trailing bytes after the sensor readings")
+    return messages
@@ -1,35 +1,75 @@
+import os
+import threading
+
 from pymongo import MongoClient
 
+# MongoClient holds its own connection pool and monitoring threads, so there is one per
+# server in the process, shared by every MongoDBClient
+MONGO_MAX_POOL_SIZE = int(os.environ.get("MONGO_MAX_POOL_SIZE", "100"))
+MONGO_MIN_POOL_SIZE = int(os.environ.get("MONGO_MIN_POOL_SIZE", "0"))
+MONGO_SERVER_SELECTION_TIMEOUT_MS = int(os.environ.get("MONGO_SERVER_SELECTION_TIMEOUT_MS", "5000"))
+MONGO_CONNECT_TIMEOUT_MS = int(os.environ.get("MONGO_CONNECT_TIMEOUT_MS", "5000"))
+
+_clients = {}
+_clients_lock = threading.Lock()
+
+def get_client(host, port) -> MongoClient:
+    with _clients_lock:
+        key = (host, port)
+        if key not in _clients:
+            _clients[key] = MongoClient(
+                host, port,
+                maxPoolSize=MONGO_MAX_POOL_SIZE,
+                minPoolSize=MONGO_MIN_POOL_SIZE,
+                serverSelectionTimeoutMS=MONGO_SERVER_SELECTION_TIMEOUT_MS,
+                connectTimeoutMS=MONGO_CONNECT_TIMEOUT_MS)
+        return _clients[key]
+
+def close_all():
+    with _clients_lock:
+        for client in _clients.values():
+            client.close()
+        _clients.clear()
+
+
 class MongoDBClient:
     def __init__(self, host="localhost", port=27017):
         self.host = host
         self.port = port
-        self.client = MongoClient(host, port)
-        self.database = None
-        self.collection = None
+        self.client = get_client(host, port)
+        self._database = None
+        self._collection = None
 
     def close(self):
-        self.client.close()
+        # The shared MongoClient stays open for the rest of the process, see close_all
+        self._database = None
+        self._collection = None
     
     def ping(self):
         return self.client.db_name.command('ping')
+
+    def collection(self, database, name):
+        """ Collection of a database, without changing the client: safe to share between threads. """
+        return self.client[database][name]
     
+    # getDatabase/getCollection keep the current database and collection in the client, so
+    # a client using them must not be shared between threads
     def getDatabase(self, database):
-        self.database = self.client[database]
-        return self.database
+        self._database = self.client[database]
+        return self._database
 
     def getCollection(self, collection):
-        self.collection = self.database[collection]
-        return self.collection
+        self._collection = self._database[collection]
+        return self._collection
     
     def clearDb(self,database):
         self.client.drop_database(database)
     
     def findByQuery(self, query={}):
-        return self.collection.find(query)
+        return self._collection.find(query)
     
     def find_one(self, query):
-        return self.collection.find_one(query)
+        return self._collection.find_one(query)
     
     def find(self):
-        return self.findByQuery()
\ No newline at end of file
+        return self.findByQuery()
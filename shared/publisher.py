@@ -1,33 +1,319 @@
-import pika
+import collections
+import functools
+import itertools
+import os
+import threading
 import time
+from concurrent.futures import Future
 
-QUEUE_NAME = 'test'
+import pika
 
-class Publisher:
+from shared import codec
+
+RABBITMQ_HOST = os.environ.get("RABBITMQ_HOST", "rabbitmq")
+RABBITMQ_PORT = int(os.environ.get("RABBITMQ_PORT", "5672"))
+
+# FastAPI runs the sync endpoints on a threadpool of 40 threads. A pooled connection is
+# driven by its own I/O thread and pipelines the publishes of many request threads, so a
+# handful of connections is enough to keep that threadpool busy.
+PUBLISHER_POOL_SIZE = int(os.environ.get("PUBLISHER_POOL_SIZE", "4"))
+# Seconds a publish waits for the connection to be ready and for the broker confirm
+PUBLISHER_CONFIRM_TIMEOUT = float(os.environ.get("PUBLISHER_CONFIRM_TIMEOUT", "5"))
+PUBLISHER_MAX_RECONNECT_DELAY = float(os.environ.get("PUBLISHER_MAX_RECONNECT_DELAY", "30"))
+# Wire format of the published readings, see shared/codec.py
+PUBLISHER_CONTENT_TYPE = os.environ.get("PUBLISHER_CONTENT_TYPE", codec.BINARY_CONTENT_TYPE)
+
+# Readings are published once to a topic exchange and fanned out to one durable queue
+# per sink, so each store is written by its own pool of consumers at its own pace.
+# Each sink queue is split in INGEST_SHARDS shards: the readings of a sensor always go to
+# the same shard (routing key readings.<shard>) and each shard is consumed by a single
+# worker, which keeps the readings of a sensor in order.
+EXCHANGE_NAME = 'sensor_data'
+READINGS_ROUTING_KEY = 'readings'
+SINKS = ('redis', 'timescale', 'cassandra')
+INGEST_SHARDS = int(os.environ.get("INGEST_SHARDS", "4"))
+
+def shard_for(sensor_id, shards=INGEST_SHARDS):
+    # Jump consistent hash: only 1/shards of the sensors move when a shard is added
+    key = sensor_id & 0xFFFFFFFFFFFFFFFF
+    bucket, candidate = -1, 0
+    while candidate < shards:
+        bucket = candidate
+        key = (key * 2862933555777941757 + 1) & 0xFFFFFFFFFFFFFFFF
+        candidate = int((bucket + 1) * (float(1 << 31) / float((key >> 33) + 1)))
+    return bucket
+
+def shard_queue(sink, shard):
+    return f'sensor_data.{sink}.{shard}'
+
+def sink_queues(sink):
+    return [shard_queue(sink, shard) for shard in range(INGEST_SHARDS)]
+
+# Single queue per sink used before the queues were sharded. It is no longer bound to the
+# exchange; the readings left in it are moved to the shards with
+#   python -m consumer.replay <sink> --legacy
+def legacy_sink_queue(sink):
+    return f'sensor_data.{sink}'
+
+# Messages that fail to be written wait in a chain of delay queues, one per attempt with
+# a TTL of RETRY_BASE_DELAY_MS * 2^attempt, and are dead-lettered back to their sink queue
+# when it expires. After RETRY_MAX_ATTEMPTS they are parked in the sink's dead letter queue.
+RETRY_MAX_ATTEMPTS = int(os.environ.get("RETRY_MAX_ATTEMPTS", "5"))
+RETRY_BASE_DELAY_MS = int(os.environ.get("RETRY_BASE_DELAY_MS", "1000"))
+RETRY_COUNT_HEADER = 'x-retry-count'
+
+def retry_queue(queue, attempt):
+    return f'{queue}.retry.{attempt}'
 
-    channel = None
-    conn = None
+def dead_letter_queue(queue):
+    return f'{queue}.dead'
+
+def topology():
+    # (channel method, arguments) pairs, shared by blocking and asynchronous channels
+    steps = [('exchange_declare', {'exchange': EXCHANGE_NAME, 'exchange_type': 'topic', 'durable': True})]
+    for sink in SINKS:
+        for shard in range(INGEST_SHARDS):
+            queue = shard_queue(sink, shard)
+            steps.append(('queue_declare', {'queue': queue, 'durable': True}))
+            steps.append(('queue_bind', {'queue': queue, 'exchange': EXCHANGE_NAME, 'routing_key': f'{READINGS_ROUTING_KEY}.{shard}'}))
+            steps.extend(_retry_topology(queue))
+        # Declared so that unbinding works on brokers that never had it
+        legacy_queue = legacy_sink_queue(sink)
+        steps.append(('queue_declare', {'queue': legacy_queue, 'durable': True}))
+        steps.append(('queue_unbind', {'queue': legacy_queue, 'exchange': EXCHANGE_NAME, 'routing_key': f'{READINGS_ROUTING_KEY}.#'}))
+    return steps
+
+def _retry_topology(queue):
+    steps = []
+    for attempt in range(RETRY_MAX_ATTEMPTS):
+        steps.append(('queue_declare', {'queue': retry_queue(queue, attempt), 'durable': True, 'arguments': {
+            'x-message-ttl': RETRY_BASE_DELAY_MS * 2 ** attempt,
+            'x-dead-letter-exchange': '',
+            'x-dead-letter-routing-key': queue,
+        }}))
+    steps.append(('queue_declare', {'queue': dead_letter_queue(queue), 'durable': True}))
+    return steps
+
+def declare_topology(channel):
+    for method, arguments in topology():
+        getattr(channel, method)(**arguments)
+
+
+def connection_parameters():
+    credentials = pika.PlainCredentials('guest', 'guest')
+    return pika.ConnectionParameters(RABBITMQ_HOST,
+                                     RABBITMQ_PORT,
+                                     '/',
+                                     credentials)
+
+
+class PublishError(Exception):
+    pass
+
+
+class PublisherStats:
+    """ Thread-safe counters of the publisher, with the confirmed throughput of the last minute. """
+
+    WINDOW = 60
 
     def __init__(self):
-        credentials = pika.PlainCredentials('guest', 'guest')
-        parameters = pika.ConnectionParameters('rabbitmq',
-                                       5672,
-                                       '/',
-                                       credentials)
-        try:
-            self.conn = pika.BlockingConnection(parameters)
-        except Exception as e:
-            time.sleep(10)
-            self.conn = pika.BlockingConnection(parameters)
-
-        self.channel = self.conn.channel()
-        self.channel.queue_declare(queue=QUEUE_NAME)
-
-
-    
-    def publish(self, message):
-        self.channel.basic_publish(exchange='', routing_key=QUEUE_NAME, body=message.to_json())
-        print(" [x] Sent %r" % message)
-    
+        self._lock = threading.Lock()
+        self.published = 0
+        self.confirmed = 0
+        self.nacked = 0
+        self.failed = 0
+        self.reconnects = 0
+        self._per_second = collections.deque(maxlen=self.WINDOW)
+
+    def add(self, counter, amount=1):
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + amount)
+            if counter == 'confirmed':
+                second = int(time.monotonic())
+                if self._per_second and self._per_second[-1][0] == second:
+                    self._per_second[-1][1] += amount
+                else:
+                    self._per_second.append([second, amount])
+
+    def snapshot(self):
+        with self._lock:
+            now = int(time.monotonic())
+            recent = sum(count for second, count in self._per_second if now - second < self.WINDOW)
+            return {
+                "published": self.published,
+                "confirmed": self.confirmed,
+                "nacked": self.nacked,
+                "failed": self.failed,
+                "in_flight": self.published - self.confirmed - self.nacked - self.failed,
+                "reconnects": self.reconnects,
+                "confirmed_per_second": recent / self.WINDOW,
+            }
+
+
+class _PooledConnection(threading.Thread):
+    """ One SelectConnection driven by its own I/O thread. Other threads hand it messages
+    through add_callback_threadsafe, the publishes are pipelined on a channel in confirm
+    mode and the broker acknowledges them in batches (multiple=True). The connection is
+    reopened with an exponential backoff whenever it is lost. """
+
+    def __init__(self, stats):
+        super().__init__(daemon=True)
+        self.stats = stats
+        self.connection = None
+        self.channel = None
+        self.ready = threading.Event()
+        self.stopping = False
+        self.was_ready = False
+        self.delivery_tag = 0
+        # Futures waiting for a confirm, in delivery tag order
+        self.pending = collections.OrderedDict()
+
+    def run(self):
+        delay = 1
+        while not self.stopping:
+            self.was_ready = False
+            self.connection = pika.SelectConnection(connection_parameters(),
+                                                    on_open_callback=self._on_connection_open,
+                                                    on_open_error_callback=self._on_connection_lost,
+                                                    on_close_callback=self._on_connection_lost)
+            self.connection.ioloop.start()
+            if self.stopping:
+                break
+            # the backoff starts over after a connection that got ready
+            delay = 1 if self.was_ready else min(delay * 2, PUBLISHER_MAX_RECONNECT_DELAY)
+            self.stats.add('reconnects')
+            time.sleep(delay)
+
+    def publish(self, exchange, routing_key, body, properties):
+        future = Future()
+        if not self.ready.wait(PUBLISHER_CONFIRM_TIMEOUT):
+            raise PublishError("RabbitMQ connection is not available")
+        self.connection.ioloop.add_callback_threadsafe(
+            functools.partial(self._publish, exchange, routing_key, body, properties, future))
+        return future
+
+    def close(self):
+        self.stopping = True
+        if self.connection is not None:
+            try:
+                self.connection.ioloop.add_callback_threadsafe(self._close)
+            except Exception:
+                pass
+        self.join(timeout=PUBLISHER_CONFIRM_TIMEOUT)
+
+    # Everything below runs on the I/O thread
+
+    def _publish(self, exchange, routing_key, body, properties, future):
+        if not self.ready.is_set():
+            future.set_exception(PublishError("RabbitMQ connection lost before publishing"))
+            self.stats.add('published')
+            self.stats.add('failed')
+            return
+        self.channel.basic_publish(exchange=exchange, routing_key=routing_key, body=body, properties=properties)
+        self.delivery_tag += 1
+        self.pending[self.delivery_tag] = future
+        self.stats.add('published')
+
+    def _on_connection_open(self, connection):
+        connection.channel(on_open_callback=self._on_channel_open)
+
+    def _on_channel_open(self, channel):
+        self.channel = channel
+        self.delivery_tag = 0
+        channel.add_on_close_callback(self._on_channel_closed)
+        channel.confirm_delivery(ack_nack_callback=self._on_delivery_confirmation,
+                                 callback=lambda _frame: self._declare(topology()))
+
+    def _declare(self, steps):
+        if not steps:
+            self.was_ready = True
+            self.ready.set()
+            return
+        (method, arguments), rest = steps[0], steps[1:]
+        getattr(self.channel, method)(callback=lambda _frame: self._declare(rest), **arguments)
+
+    def _on_delivery_confirmation(self, frame):
+        method = frame.method
+        acked = isinstance(method, pika.spec.Basic.Ack)
+        if method.multiple:
+            tags = list(itertools.takewhile(lambda tag: tag <= method.delivery_tag, self.pending))
+        else:
+            tags = [method.delivery_tag] if method.delivery_tag in self.pending else []
+        for tag in tags:
+            future = self.pending.pop(tag)
+            if acked:
+                future.set_result(tag)
+            else:
+                future.set_exception(PublishError("Message rejected by RabbitMQ"))
+        self.stats.add('confirmed' if acked else 'nacked', len(tags))
+
+    def _on_channel_closed(self, channel, reason):
+        print(f"RabbitMQ channel closed: {reason}")
+        self.ready.clear()
+        if not self.connection.is_closing and not self.connection.is_closed:
+            self.connection.close()
+
+    def _on_connection_lost(self, connection, reason):
+        if not self.stopping:
+            print(f"RabbitMQ connection lost, reconnecting: {reason}")
+        self.ready.clear()
+        # Unconfirmed messages may or may not have reached the queue, let the caller decide
+        for future in self.pending.values():
+            future.set_exception(PublishError("RabbitMQ connection lost before the confirm"))
+        self.stats.add('failed', len(self.pending))
+        self.pending.clear()
+        connection.ioloop.stop()
+
+    def _close(self):
+        self.ready.clear()
+        if not self.connection.is_closing and not self.connection.is_closed:
+            self.connection.close()
+
+
+class Publisher:
+    """ Thread-safe publisher backed by a pool of connections. Each request thread keeps
+    using the same pooled connection, assigned round robin on its first publish. """
+
+    def __init__(self, pool_size=PUBLISHER_POOL_SIZE):
+        self.stats = PublisherStats()
+        self.pool = [_PooledConnection(self.stats) for _ in range(max(pool_size, 1))]
+        for connection in self.pool:
+            connection.start()
+        self._next = itertools.count()
+        self._local = threading.local()
+
+    def _connection(self):
+        if not hasattr(self._local, 'connection'):
+            self._local.connection = self.pool[next(self._next) % len(self.pool)]
+        return self._local.connection
+
+    def publish(self, messages, wait=True):
+        """ Publish one reading, or a list of readings packed into one message per shard, and
+        with wait block until the broker confirms them. Without wait, the confirm futures
+        are returned. """
+        if not isinstance(messages, list):
+            messages = [messages]
+        shards = collections.defaultdict(list)
+        for message in messages:
+            shards[shard_for(message.sensor_id)].append(message)
+        properties = pika.BasicProperties(content_type=PUBLISHER_CONTENT_TYPE,
+                                          delivery_mode=pika.DeliveryMode.Persistent)
+        connection = self._connection()
+        futures = [
+            connection.publish(EXCHANGE_NAME, f'{READINGS_ROUTING_KEY}.{shard}', codec.encode(shard_messages, PUBLISHER_CONTENT_TYPE), properties)
+            for shard, shard_messages in shards.items()
+        ]
+        if not wait:
+            return futures
+        for future in futures:
+            future.result(timeout=PUBLISHER_CONFIRM_TIMEOUT)
+
+    def get_stats(self):
+        stats = self.stats.snapshot()
+        stats["connections"] = len(self.pool)
+        stats["connections_ready"] = sum(connection.ready.is_set() for connection in self.pool)
+        return stats
+
     def close(self):
-        self.conn.close()
+        for connection in self.pool:
+            connection.close()
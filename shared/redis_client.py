@@ -1,13 +1,42 @@
+import os
+import threading
+from contextlib import contextmanager
+
 import redis
 
+# Process-wide connection pools, one per server. A command waits up to REDIS_POOL_TIMEOUT
+# seconds for a connection when all REDIS_POOL_MAX_CONNECTIONS are in use.
+REDIS_POOL_MAX_CONNECTIONS = int(os.environ.get("REDIS_POOL_MAX_CONNECTIONS", "50"))
+REDIS_POOL_TIMEOUT = float(os.environ.get("REDIS_POOL_TIMEOUT", "5"))
+REDIS_SOCKET_TIMEOUT = float(os.environ.get("REDIS_SOCKET_TIMEOUT", "5"))
+REDIS_SOCKET_CONNECT_TIMEOUT = float(os.environ.get("REDIS_SOCKET_CONNECT_TIMEOUT", "5"))
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+def get_pool(host, port, db) -> redis.BlockingConnectionPool:
+    with _pools_lock:
+        key = (host, port, db)
+        if key not in _pools:
+            _pools[key] = redis.BlockingConnectionPool(
+                host=host, port=port, db=db,
+                max_connections=REDIS_POOL_MAX_CONNECTIONS,
+                timeout=REDIS_POOL_TIMEOUT,
+                socket_timeout=REDIS_SOCKET_TIMEOUT,
+                socket_connect_timeout=REDIS_SOCKET_CONNECT_TIMEOUT)
+        return _pools[key]
+
+
 class RedisClient:
     def __init__(self, host='localhost', port=6379, db=0):
         self._host = host
         self._port = port
         self._db = db
-        self._client = redis.Redis(host=self._host, port=self._port, db=self._db)
+        # Clients are cheap, they borrow connections from the shared pool of the server
+        self._client = redis.Redis(connection_pool=get_pool(self._host, self._port, self._db))
     
     def close(self):
+        # Returns the connections to the pool, the pool itself stays open
         self._client.close()
 
     def ping(self):
@@ -18,14 +47,45 @@ class RedisClient:
     
     def set(self, key, value):
         return self._client.set(key, value)
+
+    def mget(self, keys):
+        """ Values of the keys in one round trip, None for the missing ones. """
+        return self._client.mget(keys) if keys else []
+
+    def mset(self, mapping):
+        return self._client.mset(mapping) if mapping else True
     
-    def delete(self, key):
-        return self._client.delete(key)
+    def hgetall(self, key):
+        return self._client.hgetall(key)
+
+    def publish(self, channel, message):
+        return self._client.publish(channel, message)
+
+    def pubsub(self, **kwargs):
+        return self._client.pubsub(**kwargs)
+    
+    def register_script(self, script):
+        return self._client.register_script(script)
+
+    def pipeline(self, transaction=False):
+        return self._client.pipeline(transaction=transaction)
+
+    @contextmanager
+    def batch(self, transaction=False):
+        """ Pipeline whose commands are sent in one round trip when the block ends without
+        error, wrapped in MULTI/EXEC when transaction is set. """
+        with self._client.pipeline(transaction=transaction) as pipe:
+            yield pipe
+            pipe.execute()
+
+    def delete(self, *keys):
+        return self._client.delete(*keys)
     
     def keys(self, pattern):
         return self._client.keys(pattern)
     
     def clearAll(self):
-        for key in self._client.keys("*"):
-            self._client.delete(key)
+        keys = self._client.keys("*")
+        if keys:
+            self._client.delete(*keys)
     
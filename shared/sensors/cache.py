@@ -0,0 +1,187 @@
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from redis.exceptions import WatchError
+
+from shared.redis_client import RedisClient
+
+# Read-through cache of the merged sensor record ({"id", "name", **metadata}) that most
+# requests look up. Sensor metadata hardly changes, so it is kept in two tiers:
+# - an LRU of up to SENSOR_CACHE_SIZE records in each process, for SENSOR_CACHE_TTL seconds,
+# - a Redis hash per sensor shared by all the API replicas, for SENSOR_CACHE_REDIS_TTL seconds.
+# A deleted sensor is removed from Redis and announced on SENSOR_CACHE_CHANNEL, so every
+# replica drops it from its LRU. Deleting also bumps the generation of the sensor, and a
+# record loaded from the primaries is only cached while the generation it was loaded at is
+# still current, so a load that races with the deletion cannot store the deleted sensor.
+SENSOR_CACHE_SIZE = int(os.environ.get("SENSOR_CACHE_SIZE", "10000"))
+SENSOR_CACHE_TTL = float(os.environ.get("SENSOR_CACHE_TTL", "60"))
+SENSOR_CACHE_REDIS_TTL = int(os.environ.get("SENSOR_CACHE_REDIS_TTL", "3600"))
+SENSOR_CACHE_CHANNEL = "sensor-cache-invalidations"
+
+# Default generation of put, for records that are current by construction
+_CURRENT = object()
+
+
+def sensor_cache_key(sensor_id: int) -> str:
+    return f"sensor:{sensor_id}:meta"
+
+
+def sensor_generation_key(sensor_id: int) -> str:
+    return f"sensor:{sensor_id}:gen"
+
+
+class SensorCache:
+    def __init__(self, redis: RedisClient):
+        self.redis = redis
+        self._lock = threading.Lock()
+        # sensor_id -> (expiry monotonic time, record)
+        self._local = OrderedDict()
+        self._stats = {"local_hits": 0, "redis_hits": 0, "misses": 0, "invalidations": 0, "stale_loads": 0}
+        self._listener = None
+        self._listener_error = None
+
+    def get(self, sensor_id: int, load):
+        """ Record of the sensor, read from the LRU, then Redis, then load(sensor_id) (the
+        primary databases) filling both tiers. None when load finds no sensor. """
+        record = self._get_local(sensor_id)
+        if record is not None:
+            self._count("local_hits")
+            return dict(record)
+        try:
+            stored = self.redis.hgetall(sensor_cache_key(sensor_id))
+        except Exception as e:
+            print(f"Error reading the sensor cache: {e}")
+            stored = None
+        if stored:
+            self._count("redis_hits")
+            record = {key.decode(): json.loads(value) for key, value in stored.items()}
+            self._put_local(sensor_id, record)
+            return dict(record)
+        self._count("misses")
+        try:
+            generation = self.redis.get(sensor_generation_key(sensor_id))
+        except Exception as e:
+            print(f"Error reading the sensor cache: {e}")
+            return load(sensor_id)
+        record = load(sensor_id)
+        if record is not None:
+            self.put(record, generation=generation)
+        return record
+
+    def put(self, record: dict, generation=_CURRENT):
+        """ Store the record of a sensor, e.g. when it is created. A record loaded from the
+        primaries passes the generation read before loading it, and is dropped when the
+        sensor has been invalidated since. """
+        sensor_id = record["id"]
+        key = sensor_cache_key(sensor_id)
+        try:
+            with self.redis.pipeline(transaction=True) as pipe:
+                if generation is not _CURRENT:
+                    pipe.watch(sensor_generation_key(sensor_id))
+                    if pipe.get(sensor_generation_key(sensor_id)) != generation:
+                        self._count("stale_loads")
+                        return
+                    pipe.multi()
+                pipe.delete(key)
+                pipe.hset(key, mapping={field: json.dumps(value) for field, value in record.items()})
+                pipe.expire(key, SENSOR_CACHE_REDIS_TTL)
+                pipe.execute()
+        except WatchError:
+            self._count("stale_loads")
+            return
+        except Exception as e:
+            print(f"Error writing the sensor cache: {e}")
+            if generation is not _CURRENT:
+                # Without Redis the generation cannot be checked, the record is not cached
+                return
+        self._put_local(sensor_id, dict(record))
+
+    def invalidate(self, sensor_id: int):
+        """ Forget the sensor in Redis, in this process and, through pub/sub, in the others.
+        Errors are printed, the entries then expire with the TTLs. """
+        self._drop_local(sensor_id)
+        try:
+            with self.redis.batch(transaction=True) as pipe:
+                pipe.incr(sensor_generation_key(sensor_id))
+                pipe.expire(sensor_generation_key(sensor_id), SENSOR_CACHE_REDIS_TTL)
+                pipe.delete(sensor_cache_key(sensor_id))
+            self.redis.publish(SENSOR_CACHE_CHANNEL, str(sensor_id))
+        except Exception as e:
+            print(f"Error invalidating the sensor cache: {e}")
+
+    def clear(self):
+        """ Forget every sensor, in Redis and in the LRU of all the processes, e.g. after
+        the primary databases have been emptied. """
+        with self._lock:
+            self._local.clear()
+        keys = self.redis.keys(sensor_cache_key("*"))
+        if keys:
+            self.redis.delete(*keys)
+        self.redis.publish(SENSOR_CACHE_CHANNEL, "*")
+
+    def get_stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats["local_size"] = len(self._local)
+        stats["listening"] = self._listener is not None and self._listener.is_alive()
+        stats["listener_error"] = self._listener_error
+        lookups = stats["local_hits"] + stats["redis_hits"] + stats["misses"]
+        stats["hit_ratio"] = round((stats["local_hits"] + stats["redis_hits"]) / lookups, 4) if lookups else None
+        return stats
+
+    def start(self):
+        """ Listen to the invalidations of the other processes in a background thread. """
+        if self._listener is None:
+            try:
+                pubsub = self.redis.pubsub(ignore_subscribe_messages=True)
+                pubsub.subscribe(**{SENSOR_CACHE_CHANNEL: self._on_invalidation})
+                self._listener = pubsub.run_in_thread(sleep_time=1, daemon=True)
+            except Exception as e:
+                self._listener_error = str(e)
+                raise
+            self._listener_error = None
+
+    def stop(self):
+        if self._listener is not None:
+            self._listener.stop()
+            self._listener = None
+
+    def _on_invalidation(self, message):
+        if message["data"] == b"*":
+            with self._lock:
+                self._local.clear()
+            return
+        try:
+            self._drop_local(int(message["data"]))
+        except ValueError:
+            pass
+
+    def _get_local(self, sensor_id):
+        with self._lock:
+            entry = self._local.get(sensor_id)
+            if entry is None:
+                return None
+            if entry[0] < time.monotonic():
+                del self._local[sensor_id]
+                return None
+            self._local.move_to_end(sensor_id)
+            return entry[1]
+
+    def _put_local(self, sensor_id, record):
+        with self._lock:
+            self._local[sensor_id] = (time.monotonic() + SENSOR_CACHE_TTL, record)
+            self._local.move_to_end(sensor_id)
+            while len(self._local) > SENSOR_CACHE_SIZE:
+                self._local.popitem(last=False)
+
+    def _drop_local(self, sensor_id):
+        with self._lock:
+            if self._local.pop(sensor_id, None) is not None:
+                self._stats["invalidations"] += 1
+
+    def _count(self, name):
+        with self._lock:
+            self._stats[name] += 1
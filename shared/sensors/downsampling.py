@@ -0,0 +1,78 @@
+import numpy as np
+
+# Approximate length of each bucket of the continuous aggregates, coarsest first
+BUCKET_SECONDS = {
+    "year": 365.25 * 86400,
+    "month": 30.44 * 86400,
+    "week": 7 * 86400,
+    "day": 86400,
+    "hour": 3600,
+}
+
+
+def pick_bucket(span_seconds: float, points: int):
+    """ Coarsest aggregate bucket that still has at least points buckets in the span,
+    None when even hourly buckets are too coarse and the raw readings are needed. """
+    for bucket, seconds in BUCKET_SECONDS.items():
+        if span_seconds / seconds >= points:
+            return bucket
+    return None
+
+
+def _bin_edges(start: int, end: int, bins: int):
+    # Edges of bins splitting [start, end) in bins non empty ranges of indexes
+    return np.linspace(start, end, bins + 1).astype(np.int64)
+
+
+def lttb(x: np.ndarray, y: np.ndarray, points: int) -> np.ndarray:
+    """ Indexes of the points kept by Largest-Triangle-Three-Buckets: the first and last
+    points, and from each of points - 2 bins the one forming the largest triangle with the
+    previously kept point and the average of the next bin. """
+    n = len(x)
+    if points >= n or points < 3:
+        return np.arange(n)
+    edges = _bin_edges(1, n - 1, points - 2)
+    counts = np.diff(edges)
+    # Average point of every bin, followed by the last point for the last bin
+    next_x = np.append(np.add.reduceat(x[:n - 1], edges[:-1]) / counts, x[n - 1])[1:]
+    next_y = np.append(np.add.reduceat(y[:n - 1], edges[:-1]) / counts, y[n - 1])[1:]
+    kept = np.empty(points, dtype=np.int64)
+    kept[0], kept[-1] = 0, n - 1
+    previous = 0
+    for index in range(points - 2):
+        start, end = edges[index], edges[index + 1]
+        # Twice the triangle areas, the factor does not change the largest one
+        areas = np.abs((x[previous] - next_x[index]) * (y[start:end] - y[previous])
+                       - (x[previous] - x[start:end]) * (next_y[index] - y[previous]))
+        previous = start + int(np.argmax(areas))
+        kept[index + 1] = previous
+    return kept
+
+
+def minmax(low: np.ndarray, high: np.ndarray, points: int):
+    """ Min/max decimation: the lowest value of low and the highest of high in each of
+    points / 2 bins, so peaks survive. Returns the indexes of the kept points, in order, and
+    their values. For raw readings low and high are the same array, and every point is
+    kept at most once. """
+    n = len(low)
+    bins = points // 2
+    single = low is high or np.array_equal(low, high, equal_nan=True)
+    if bins < 1 or 2 * bins >= n:
+        indexes = np.arange(n)
+        if single:
+            return indexes, low
+        return np.repeat(indexes, 2), np.column_stack((low, high)).ravel()
+    edges = _bin_edges(0, n, bins)
+    counts = np.diff(edges)
+    bin_of = np.repeat(np.arange(bins), counts)
+    # Sorting by bin then value puts the extreme of each bin at its first position
+    lowest = np.lexsort((low, bin_of))[edges[:-1]]
+    highest = np.lexsort((-high, bin_of))[edges[:-1]]
+    if single:
+        # The extremes of a bin are the same point when it is flat
+        indexes = np.unique(np.concatenate((lowest, highest)))
+        return indexes, low[indexes]
+    indexes = np.concatenate((lowest, highest))
+    values = np.concatenate((low[lowest], high[highest]))
+    order = np.argsort(indexes, kind="stable")
+    return indexes[order], values[order]
@@ -0,0 +1,80 @@
+import math
+import os
+import threading
+import time
+
+import numpy as np
+
+# Proximity queries of GET /sensors/near:
+# - "memory": answered by an in-process index of the sensor locations, loaded from the
+#   sensors collection on first use and kept up to date by create/delete of this process.
+#   It is reloaded when older than GEO_INDEX_MAX_AGE seconds, so sensors created or deleted
+#   through other API replicas show up after at most that long, and the query falls back to
+#   MongoDB when it cannot be loaded.
+# - "mongo": every query is a MongoDB $near query.
+GEO_INDEX_MODE = os.environ.get("GEO_INDEX_MODE", "memory")
+GEO_INDEX_MAX_AGE = float(os.environ.get("GEO_INDEX_MAX_AGE", "60"))
+
+EARTH_RADIUS = 6371008.8  # metres, the mean radius, as used by MongoDB 2dsphere queries
+
+
+class GeoIndex:
+    """ Sensor locations sorted by latitude. A radius query only computes the haversine
+    distance of the sensors in the latitude band of the circle, found by binary search. """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._ids = np.empty(0, dtype=np.int64)
+        self._lat = np.empty(0)
+        self._lon = np.empty(0)
+        self.loaded_at = None
+
+    def __len__(self):
+        return len(self._ids)
+
+    def load(self, sensors):
+        """ Replace the index with (id, latitude, longitude) tuples, in degrees. """
+        rows = list(sensors)
+        ids = np.array([row[0] for row in rows], dtype=np.int64)
+        lat = np.radians(np.array([row[1] for row in rows], dtype=float))
+        lon = np.radians(np.array([row[2] for row in rows], dtype=float))
+        order = np.argsort(lat, kind="stable")
+        with self._lock:
+            self._ids, self._lat, self._lon = ids[order], lat[order], lon[order]
+            self.loaded_at = time.monotonic()
+
+    def add(self, sensor_id: int, latitude: float, longitude: float):
+        lat, lon = math.radians(latitude), math.radians(longitude)
+        with self._lock:
+            keep = self._ids != sensor_id
+            ids, lats, lons = self._ids[keep], self._lat[keep], self._lon[keep]
+            position = np.searchsorted(lats, lat)
+            self._ids = np.insert(ids, position, sensor_id)
+            self._lat = np.insert(lats, position, lat)
+            self._lon = np.insert(lons, position, lon)
+
+    def remove(self, sensor_id: int):
+        with self._lock:
+            keep = self._ids != sensor_id
+            self._ids, self._lat, self._lon = self._ids[keep], self._lat[keep], self._lon[keep]
+
+    def near(self, latitude: float, longitude: float, radius: float):
+        """ Ids of the sensors within radius metres of the point, nearest first. """
+        lat, lon = math.radians(latitude), math.radians(longitude)
+        band = radius / EARTH_RADIUS
+        with self._lock:
+            ids, lats, lons = self._ids, self._lat, self._lon
+        start = np.searchsorted(lats, lat - band, side="left")
+        end = np.searchsorted(lats, lat + band, side="right")
+        ids, lats, lons = ids[start:end], lats[start:end], lons[start:end]
+        # Haversine distance
+        a = (np.sin((lats - lat) / 2) ** 2
+             + math.cos(lat) * np.cos(lats) * np.sin((lons - lon) / 2) ** 2)
+        distances = 2 * EARTH_RADIUS * np.arcsin(np.sqrt(np.clip(a, 0, 1)))
+        inside = distances <= radius
+        ids, distances = ids[inside], distances[inside]
+        # Nearest first, ties by id
+        return ids[np.lexsort((ids, distances))].tolist()
+
+
+sensor_index = GeoIndex()
@@ -0,0 +1,81 @@
+import os
+
+from shared.timescale import Timescale
+
+# Storage policies of the raw sensor_data hypertable, applied at startup by app.main.
+# Intervals are PostgreSQL intervals ("1 day", "12 hours"); an empty value leaves the chunk
+# interval of the migrations and disables the compression or retention policy.
+TS_CHUNK_TIME_INTERVAL = os.environ.get("TS_CHUNK_TIME_INTERVAL", "")
+# Chunks older than this are compressed
+TS_COMPRESS_AFTER = os.environ.get("TS_COMPRESS_AFTER", "7 days")
+# Chunks older than this are dropped. The continuous aggregates keep the history: dropping
+# raw chunks does not invalidate them, so their buckets survive the raw readings.
+# Readings arriving later than this are dropped by the next run of the policy.
+TS_RETENTION_AFTER = os.environ.get("TS_RETENTION_AFTER", "")
+
+HYPERTABLE = "sensor_data"
+
+CHUNK_STATS_QUERY = """
+    SELECT count(*), count(*) FILTER (WHERE is_compressed), min(range_start), max(range_end)
+    FROM timescaledb_information.chunks
+    WHERE hypertable_name = %s"""
+
+COMPRESSION_STATS_QUERY = """
+    SELECT before_compression_total_bytes, after_compression_total_bytes
+    FROM hypertable_compression_stats(%s)"""
+
+JOBS_QUERY = """
+    SELECT j.job_id, j.proc_name, j.schedule_interval::text, j.config,
+           s.last_run_status, s.last_successful_finish, s.next_start
+    FROM timescaledb_information.jobs j
+    LEFT JOIN timescaledb_information.job_stats s ON s.job_id = j.job_id
+    WHERE j.hypertable_name = %s
+    ORDER BY j.job_id"""
+
+
+def apply_policies(timescale: Timescale):
+    """ Set the chunk interval and the compression and retention policies of sensor_data
+    from the environment. Policies are recreated so a changed interval takes effect. """
+    try:
+        if TS_CHUNK_TIME_INTERVAL:
+            timescale.execute("SELECT set_chunk_time_interval(%s, %s::interval)", (HYPERTABLE, TS_CHUNK_TIME_INTERVAL))
+        timescale.execute("SELECT remove_compression_policy(%s, if_exists => true)", (HYPERTABLE,))
+        if TS_COMPRESS_AFTER:
+            timescale.execute("SELECT add_compression_policy(%s, %s::interval)", (HYPERTABLE, TS_COMPRESS_AFTER))
+        timescale.execute("SELECT remove_retention_policy(%s, if_exists => true)", (HYPERTABLE,))
+        if TS_RETENTION_AFTER:
+            timescale.execute("SELECT add_retention_policy(%s, %s::interval)", (HYPERTABLE, TS_RETENTION_AFTER))
+        timescale.conn.commit()
+    except Exception:
+        timescale.conn.rollback()
+        raise
+
+
+def get_storage_stats(timescale: Timescale):
+    """ Chunks, compression ratio and policy jobs of sensor_data. """
+    chunks, compressed, oldest, newest = timescale.fetch_one(CHUNK_STATS_QUERY, (HYPERTABLE,))
+    before, after = timescale.fetch_one(COMPRESSION_STATS_QUERY, (HYPERTABLE,)) or (None, None)
+    total_bytes = timescale.fetch_one("SELECT hypertable_size(%s)", (HYPERTABLE,))[0]
+    jobs = timescale.fetch_all(JOBS_QUERY, (HYPERTABLE,))
+    return {
+        "hypertable": HYPERTABLE,
+        "total_bytes": total_bytes,
+        "chunks": {
+            "total": chunks,
+            "compressed": compressed,
+            "oldest": oldest,
+            "newest": newest,
+        },
+        "compression": {
+            "before_bytes": before,
+            "after_bytes": after,
+            "ratio": round(before / after, 2) if before and after else None,
+        },
+        "policies": {
+            "chunk_time_interval": TS_CHUNK_TIME_INTERVAL or None,
+            "compress_after": TS_COMPRESS_AFTER or None,
+            "retention_after": TS_RETENTION_AFTER or None,
+        },
+        "jobs": [dict(zip(["job_id", "proc_name", "schedule_interval", "config", "last_run_status",
+                           "last_successful_finish", "next_start"], job)) for job in jobs],
+    }
@@ -0,0 +1,159 @@
+import math
+import os
+import threading
+import time
+from datetime import datetime, timezone
+from typing import Optional
+
+import psycopg2
+
+from shared.timescale import Timescale
+
+# Refresh strategy of the continuous aggregates read by GET /sensors/{sensor_id}/data.
+# Reads never refresh the whole view: the background policies of views/views_migrations.sql
+# keep it up to date, and the views use real-time aggregation, so the buckets past the
+# materialized part of the view (its watermark) are computed from sensor_data on the fly.
+# Readings that arrive late, for buckets already materialized, stay invisible until the next
+# policy run; with AGGREGATE_REFRESH_MODE=tail a read whose window overlaps such pending
+# invalidations refreshes only that part of the window. With "none" reads rely on the
+# policies alone.
+# The watermark and the pending invalidations are read from TimescaleDB internals, which may
+# change between versions; when they can't be read, reads fall back to the policies alone.
+AGGREGATE_REFRESH_MODE = os.environ.get("AGGREGATE_REFRESH_MODE", "tail")
+# A window refreshed less than this many seconds ago is not refreshed again
+AGGREGATE_REFRESH_MIN_INTERVAL = float(os.environ.get("AGGREGATE_REFRESH_MIN_INTERVAL", "5"))
+AGGREGATE_REFRESH_TIMEOUT = float(os.environ.get("AGGREGATE_REFRESH_TIMEOUT", "30"))
+
+BUCKET_INTERVALS = {
+    "hour": "1 hour",
+    "day": "1 day",
+    "week": "1 week",
+    "month": "1 month",
+    "year": "1 year",
+}
+
+# TimescaleDB moved its internal functions to _timescaledb_functions in 2.12; the schema
+# of the server is looked up on first use
+FUNCTION_SCHEMA_QUERY = """
+    SELECT nspname FROM pg_namespace
+    WHERE nspname IN ('_timescaledb_functions', '_timescaledb_internal')
+    ORDER BY nspname = '_timescaledb_functions' DESC
+    LIMIT 1"""
+
+WATERMARK_QUERY = """
+    SELECT extract(epoch FROM {schema}.to_timestamp({schema}.cagg_watermark(h.id)))
+    FROM timescaledb_information.continuous_aggregates c
+    JOIN _timescaledb_catalog.hypertable h
+      ON h.schema_name = c.materialization_hypertable_schema
+     AND h.table_name = c.materialization_hypertable_name
+    WHERE c.view_name = %s"""
+
+# Window to refresh: from the bucket of from_ to the end of the bucket of min(to, watermark),
+# so whole materialized buckets are refreshed. No row when the window is past the watermark
+# or no pending invalidation of the view overlaps it. Invalidations are kept in internal time,
+# microseconds since the Unix epoch, first per raw hypertable and then per aggregate.
+STALE_WINDOW_QUERY = """
+    WITH bounds AS (
+        SELECT time_bucket(%(width)s::interval, %(from)s::timestamptz) AS start_,
+               LEAST(time_bucket(%(width)s::interval, %(to)s::timestamptz) + %(width)s::interval,
+                     %(watermark)s::timestamptz) AS end_
+    ), cagg AS (
+        SELECT mat_hypertable_id, raw_hypertable_id
+        FROM _timescaledb_catalog.continuous_agg
+        WHERE user_view_name = %(view)s
+    ), internal AS (
+        SELECT (extract(epoch FROM start_) * 1000000)::bigint AS lo,
+               (extract(epoch FROM end_) * 1000000)::bigint AS hi
+        FROM bounds
+    )
+    SELECT start_, end_ FROM bounds
+    WHERE start_ < end_
+      AND (EXISTS (SELECT 1 FROM _timescaledb_catalog.continuous_aggs_hypertable_invalidation_log l, cagg, internal i
+                   WHERE l.hypertable_id = cagg.raw_hypertable_id
+                     AND l.lowest_modified_value < i.hi AND l.greatest_modified_value >= i.lo)
+        OR EXISTS (SELECT 1 FROM _timescaledb_catalog.continuous_aggs_materialization_invalidation_log l, cagg, internal i
+                   WHERE l.materialization_id = cagg.mat_hypertable_id
+                     AND l.lowest_modified_value < i.hi AND l.greatest_modified_value >= i.lo))"""
+
+_lock = threading.Lock()
+# Windows being refreshed, (view, start, end) -> Event set when the refresh ends
+_in_flight = {}
+# Windows refreshed recently, (view, start, end) -> monotonic time of the refresh
+_refreshed = {}
+_function_schema = None
+
+
+def watermark(timescale: Timescale, view_name: str) -> Optional[datetime]:
+    """ End of the materialized part of the view, None when nothing is materialized. """
+    row = timescale.fetch_one(WATERMARK_QUERY.format(schema=function_schema(timescale)), (view_name,))
+    if row is None or row[0] is None or not math.isfinite(row[0]):
+        return None
+    return datetime.fromtimestamp(float(row[0]), tz=timezone.utc)
+
+
+def function_schema(timescale: Timescale) -> str:
+    global _function_schema
+    with _lock:
+        if _function_schema is None:
+            _function_schema = timescale.fetch_one(FUNCTION_SCHEMA_QUERY)[0]
+        return _function_schema
+
+
+def ensure_fresh(timescale: Timescale, bucket: str, from_, to) -> Optional[datetime]:
+    """ Refresh the materialized part of [from_, to] invalidated by late readings, according
+    to AGGREGATE_REFRESH_MODE, and return the watermark of the view afterwards. """
+    view_name = f"{bucket}_aggregates"
+    timescale.enable_autocommit(True)
+    try:
+        try:
+            mark = watermark(timescale, view_name)
+        except psycopg2.Error as e:
+            print(f"Error reading the watermark of {view_name}, relying on the refresh policies: {e}")
+            return None
+        if AGGREGATE_REFRESH_MODE != "tail":
+            return mark
+        if mark is None:
+            # Nothing materialized: real-time aggregation computes the whole window
+            return mark
+        try:
+            window = timescale.fetch_one(STALE_WINDOW_QUERY, {"width": BUCKET_INTERVALS[bucket], "from": from_, "to": to,
+                                                              "watermark": mark, "view": view_name})
+        except psycopg2.Error as e:
+            print(f"Error reading the invalidations of {view_name}, relying on the refresh policies: {e}")
+            return mark
+        if window is None:
+            return mark
+        _refresh_once(timescale, view_name, window[0], window[1])
+        return watermark(timescale, view_name)
+    finally:
+        timescale.enable_autocommit(False)
+
+
+def _refresh_once(timescale: Timescale, view_name: str, start, end):
+    # Concurrent reads of the same window share one refresh: the first one runs it and the
+    # others wait for it, and a window refreshed moments ago is not refreshed again
+    with _lock:
+        now = time.monotonic()
+        for key, refreshed_at in list(_refreshed.items()):
+            if now - refreshed_at >= AGGREGATE_REFRESH_MIN_INTERVAL:
+                del _refreshed[key]
+        if any(_covers(key, view_name, start, end) for key in _refreshed):
+            return
+        running = next((event for key, event in _in_flight.items() if _covers(key, view_name, start, end)), None)
+        if running is None:
+            key = (view_name, start, end)
+            event = _in_flight[key] = threading.Event()
+    if running is not None:
+        running.wait(AGGREGATE_REFRESH_TIMEOUT)
+        return
+    try:
+        timescale.execute("CALL refresh_continuous_aggregate(%s, %s, %s)", (view_name, start, end))
+    finally:
+        with _lock:
+            del _in_flight[key]
+            _refreshed[key] = time.monotonic()
+        event.set()
+
+
+def _covers(key, view_name, start, end):
+    return key[0] == view_name and key[1] <= start and key[2] >= end
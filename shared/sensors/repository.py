@@ -1,16 +1,23 @@
 from fastapi import HTTPException
 from sqlalchemy.orm import Session
 from typing import List, Optional
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
 from collections import defaultdict
+from pymongo.errors import OperationFailure
 
 from shared.mongodb_client import MongoDBClient
 from shared.redis_client import RedisClient
-from shared.sensors import models, schemas
+from shared.sensors.cache import SensorCache
+from shared.sensors import downsampling, geoindex, models, refresh, schemas
 from shared.timescale import Timescale
 from shared.elasticsearch_client import ElasticsearchClient
 
+import csv
+import io
 import json
+import time
+
+import numpy as np
 
 class DataCommand():
     def __init__(self, from_time, to_time, bucket):
@@ -23,12 +30,23 @@ class DataCommand():
         self.bucket = bucket
 
 index_es_name = "sensors"
+mongo_db_name = "P2Documentales"
+mongo_sensors_collection = "sensors"
+
+def sensors_collection(mongodb_client: MongoDBClient):
+    return mongodb_client.collection(mongo_db_name, mongo_sensors_collection)
+
 def get_sensor(db: Session, sensor_id: int) -> Optional[models.Sensor]:
     db_sensor = db.query(models.Sensor).filter(models.Sensor.id == sensor_id).first()
     if db_sensor is None:
         raise HTTPException(status_code=404, detail="Sensor not found")
     return db_sensor
 
+def get_existing_sensor_ids(db: Session, sensor_ids) -> set:
+    # Existence check of many sensors with a single query
+    rows = db.query(models.Sensor.id).filter(models.Sensor.id.in_(set(sensor_ids))).all()
+    return {row.id for row in rows}
+
 def get_sensor_by_name(db: Session, name: str) -> Optional[models.Sensor]:
     return db.query(models.Sensor).filter(models.Sensor.name == name).first()
 
@@ -44,21 +62,64 @@ def create_sensor(db: Session, sensor: schemas.SensorCreate) -> models.Sensor:
 
 def insertMongodb(mongodb_client: MongoDBClient, sensor_document):
     try:
-        mongodb_client.getDatabase('P2Documentales')
-        mongodb_client.getCollection('sensors')
-        mongodb_client.collection.insert_one(sensor_document)
+        sensors_collection(mongodb_client).insert_one(sensor_document)
     except Exception as e:
         print(f"Error al insertar en MongoDB: {e}")
         raise HTTPException(status_code=500, detail="Failed to insert sensor data into MongoDB")
+    longitude, latitude = sensor_document["location"]["coordinates"]
+    geoindex.sensor_index.add(sensor_document["id"], latitude, longitude)
 
 
+# Last-write-wins update of the latest reading of a sensor. The reading is only stored
+# when it is at least as recent as the stored one, so redelivered or reordered readings
+# never overwrite a newer value. The last_seen of the stored reading is kept next to it
+# in microseconds, an empty one (unparseable timestamp) always overwrites.
+# KEYS: data key, last_seen key. ARGV: reading JSON, last_seen.
+LATEST_READING_SCRIPT = """
+local stored = redis.call('GET', KEYS[2])
+if stored and ARGV[2] ~= '' and tonumber(stored) > tonumber(ARGV[2]) then
+    return 0
+end
+redis.call('SET', KEYS[1], ARGV[1])
+if ARGV[2] ~= '' then
+    redis.call('SET', KEYS[2], ARGV[2])
+end
+return 1
+"""
+
+def latest_reading_keys(sensor_id: int) -> List[str]:
+    return [f"sensor:{sensor_id}:data", f"sensor:{sensor_id}:last_seen"]
+
+def last_seen_micros(last_seen: str):
+    try:
+        seen = datetime.fromisoformat(last_seen)
+    except ValueError:
+        return ""
+    if seen.tzinfo is None:
+        seen = seen.replace(tzinfo=timezone.utc)
+    return int(seen.timestamp() * 1_000_000)
+
 def record_data(redis: RedisClient, sensor_id: int, data: schemas.SensorData) -> schemas.Sensor:
     data_dict = data.dict()
-    redis_key = f"sensor:{sensor_id}:data"
     data_json = json.dumps(data_dict)
-    success = redis.set(redis_key, data_json)
-    if not success:
-        raise HTTPException(status_code=500, detail="Failed to set data in Redis")
+    latest_reading = redis.register_script(LATEST_READING_SCRIPT)
+    latest_reading(keys=latest_reading_keys(sensor_id), args=[data_json, last_seen_micros(data.last_seen)])
+
+def record_data_bulk(redis: RedisClient, messages: List[schemas.SensorDataMessage]):
+    # Only the most recent reading of each sensor in the batch can end up in Redis, so the
+    # batch is coalesced to one update per sensor, all sent in one pipeline round trip
+    latest = {}
+    for message in messages:
+        seen = last_seen_micros(message.data.last_seen)
+        current = latest.get(message.sensor_id)
+        if current is None or seen == "" or current[0] == "" or seen >= current[0]:
+            latest[message.sensor_id] = (seen, message)
+    latest_reading = redis.register_script(LATEST_READING_SCRIPT)
+    with redis.batch() as pipe:
+        for sensor_id, (seen, message) in latest.items():
+            latest_reading(keys=latest_reading_keys(sensor_id),
+                           args=[json.dumps(message.data.dict()), seen],
+                           client=pipe)
 
 
 def delete_sensor(db: Session, sensor_id: int):
@@ -70,13 +131,14 @@ def delete_sensor(db: Session, sensor_id: int):
     return db_sensor
 
 def deleteSensorRedis(redis: RedisClient, sensor_id: int):
-    redis_key = f"sensor:{sensor_id}:data"
-    redis.delete(redis_key)
+    redis.delete(*latest_reading_keys(sensor_id))
 
-def deleteSensorMongodb(mongodb_client: MongoDBClient, sensor_id: int, es: ElasticsearchClient):
-    mongodb_client.getDatabase('P2Documentales')
-    mongodb_client.getCollection('sensors')
-    mongodb_client.collection.delete_one({"id": sensor_id})
+def deleteSensorMongodb(mongodb_client: MongoDBClient, sensor_id: int, es: Optional[ElasticsearchClient] = None):
+    sensors_collection(mongodb_client).delete_one({"id": sensor_id})
+    geoindex.sensor_index.remove(sensor_id)
+    # Sensors are not indexed in Elasticsearch while insertElasticsearch is disabled
+    if es is None:
+        return
     query = {
             "query": {
                 "match": {
@@ -96,36 +158,84 @@ def get_data(redis: RedisClient, sensor_id: int) -> schemas.Sensor:
     stored_data = json.loads(stored_data.decode("utf-8"))
     return stored_data
 
+# Metadata of a sensor kept in MongoDB, besides its id and name
+SENSOR_INFO_FIELDS = ["latitude", "longitude", "type", "mac_address", "manufacturer", "model", "serie_number", "firmware_version", "description"]
+
+def _sensor_info(document, fields):
+    longitude, latitude = document.get("location", {}).get("coordinates", [None, None])
+    info = {"latitude": latitude, "longitude": longitude}
+    return {field: info[field] if field in info else document.get(field) for field in fields}
+
+def get_sensors_info(mongodb_client: MongoDBClient, ids, fields: Optional[List[str]] = None) -> dict:
+    """ Metadata of many sensors with a single $in query, keyed by id. Only the given
+    fields, all of SENSOR_INFO_FIELDS by default, are read. Unknown sensors are left out. """
+    fields = fields or SENSOR_INFO_FIELDS
+    projection = {"_id": 0, "id": 1}
+    for field in fields:
+        projection["location.coordinates" if field in ("latitude", "longitude") else field] = 1
+    documents = sensors_collection(mongodb_client).find({"id": {"$in": list(set(ids))}}, projection)
+    return {document["id"]: _sensor_info(document, fields) for document in documents}
+
+def get_sensors_full(db: Session, mongodb_client: MongoDBClient, ids) -> dict:
+    """ Name and metadata of many sensors, with one Postgres and one MongoDB query, keyed
+    by id. Sensors missing in either store are left out. """
+    ids = set(ids)
+    if not ids:
+        return {}
+    names = dict(db.query(models.Sensor.id, models.Sensor.name).filter(models.Sensor.id.in_(ids)).all())
+    infos = get_sensors_info(mongodb_client, names.keys()) if names else {}
+    return {sensor_id: {"id": sensor_id, "name": names[sensor_id], **info} for sensor_id, info in infos.items()}
+
 def getInfoSensorMDB(mongodb_client: MongoDBClient, sensor_id: int):
+    return get_sensors_info(mongodb_client, [sensor_id]).get(sensor_id)
 
-    mongodb_client.getDatabase('P2Documentales')
-    mongodb_client.getCollection('sensors')
-    document= mongodb_client.find_one({"id": sensor_id})
-    if document:
-        sensor_dict = dict(document)
-        sensor_dict.pop('_id', None)
-        longitude, latitude = sensor_dict["location"]["coordinates"]
-        sensor_data = {
-            "latitude": latitude,
-            "longitude": longitude,
-            "type": sensor_dict["type"],
-            "mac_address": sensor_dict["mac_address"],
-            "manufacturer": sensor_dict["manufacturer"],
-            "model": sensor_dict["model"],
-            "serie_number": sensor_dict["serie_number"],
-            "firmware_version": sensor_dict["firmware_version"],
-            "description": sensor_dict["description"],
-        }
-        return sensor_data
-    else:
-        return None
+def get_sensor_record(sensor_cache: SensorCache, db: Session, mongodb_client: MongoDBClient, sensor_id: int) -> dict:
+    """ Name and metadata of the sensor, through the sensor cache. Raises a 404 when the
+    sensor does not exist. """
+    def load(sensor_id):
+        db_sensor = db.query(models.Sensor).filter(models.Sensor.id == sensor_id).first()
+        if db_sensor is None:
+            return None
+        return {"id": db_sensor.id, "name": db_sensor.name, **(getInfoSensorMDB(mongodb_client, sensor_id) or {})}
+    record = sensor_cache.get(sensor_id, load)
+    if record is None:
+        raise HTTPException(status_code=404, detail="Sensor not found")
+    return record
+
+def sensor_record(sensor_id: int, name: str, sensor_document) -> dict:
+    """ Record of a new sensor, from its name and MongoDB document. """
+    return {"id": sensor_id, "name": name, **_sensor_info(sensor_document, SENSOR_INFO_FIELDS)}
 
 # 
-def get_sensors_near(mongodb_client: MongoDBClient,  db:Session, redis:RedisClient,  latitude: float, longitude: float, radius: int):
-    mongodb_client.getDatabase("P2Documentales")
-    collection = mongodb_client.getCollection("sensors")
+def ensure_mongodb_indexes(mongodb_client: MongoDBClient):
     # 2dsphere index on the "location" field to enable geospatial queries
-    collection.create_index([("location", "2dsphere")])
+    sensors_collection(mongodb_client).create_index([("location", "2dsphere")])
+
+def load_geo_index(mongodb_client: MongoDBClient):
+    documents = sensors_collection(mongodb_client).find({}, {"id": 1, "location.coordinates": 1, "_id": 0})
+    geoindex.sensor_index.load((doc["id"], doc["location"]["coordinates"][1], doc["location"]["coordinates"][0])
+                               for doc in documents)
+
+def near_sensor_ids(mongodb_client: MongoDBClient, geoJSON, latitude: float, longitude: float, radius: int) -> List[int]:
+    """ Ids of the sensors near the point, nearest first, from the in-process index or
+    from MongoDB according to GEO_INDEX_MODE. """
+    if geoindex.GEO_INDEX_MODE == "memory":
+        index = geoindex.sensor_index
+        try:
+            if index.loaded_at is None or time.monotonic() - index.loaded_at > geoindex.GEO_INDEX_MAX_AGE:
+                load_geo_index(mongodb_client)
+            return index.near(latitude, longitude, radius)
+        except Exception as e:
+            print(f"Error loading the geo index, querying MongoDB: {e}")
+    collection = sensors_collection(mongodb_client)
+    try:
+        return [doc["id"] for doc in collection.find(geoJSON, {"id": 1, "_id": 0})]
+    except OperationFailure:
+        # The index is created at startup, but it is lost when the collection is dropped
+        ensure_mongodb_indexes(mongodb_client)
+        return [doc["id"] for doc in collection.find(geoJSON, {"id": 1, "_id": 0})]
+
+def get_sensors_near(mongodb_client: MongoDBClient,  db:Session, redis:RedisClient,  latitude: float, longitude: float, radius: int):
     # Construct a GeoJSON query to find sensors near a given point within a specified radius
     geoJSON = {
         "location": {
@@ -133,27 +243,25 @@ def get_sensors_near(mongodb_client: MongoDBClient,  db:Session, redis:RedisClie
                 "$geometry": {
                     "type": "Point",
                     "coordinates": [longitude, latitude],
-                    "$maxDistance": radius
                 },
-                
+                "$maxDistance": radius
             }
         }
     }
-    # Execute the query to find nearby sensors and convert into a list of dictionaries
-    nearby_sensors = list(mongodb_client.findByQuery(geoJSON))
+    ids = near_sensor_ids(mongodb_client, geoJSON, latitude, longitude, radius)
+    if not ids:
+        return []
+    # One query for the names and one MGET for the latest readings of all of them
+    db_sensors = {sensor.id: sensor for sensor in db.query(models.Sensor).filter(models.Sensor.id.in_(ids)).all()}
+    readings = redis.mget([latest_reading_keys(sensor_id)[0] for sensor_id in ids])
     sensors = []
-    # Iterate through each sensor found in the MongoDB query
-    for doc in nearby_sensors:
-        doc["_id"] = str(doc["_id"])
-        sensor = get_sensor(db=db, sensor_id=doc["id"]).__dict__
-        sensorRedis= get_data(redis, doc["id"])
-        # If sensor data is successfully retrieved, combine it with the Redis data
-        if sensor is not None:
-            sensor = {**sensor, **sensorRedis} 
-            sensors.append(sensor)        
-    if sensors is not None:
-        return sensors
-    return []
+    for sensor_id, reading in zip(ids, readings):
+        db_sensor = db_sensors.get(sensor_id)
+        # Sensors without a reading yet, or removed from Postgres, are left out
+        if db_sensor is None or reading is None:
+            continue
+        sensors.append({"id": db_sensor.id, "name": db_sensor.name, "joined_at": db_sensor.joined_at, **json.loads(reading)})
+    return sensors
 
 def insertElasticsearch(es: ElasticsearchClient,  es_doc: dict, ):
     # Check if the index exists
@@ -194,10 +302,12 @@ def searchElasticsearch(es: ElasticsearchClient, query_dict: dict ,search_type:
         )
     results = es.search(index_name=index_es_name, query=search_body)
     sensors_data = []
+    hits = results["hits"]["hits"]
+    # Additional sensor information from MongoDB, for all the hits at once
+    infos = get_sensors_info(mongodb_client, [sensor["_source"]["id"] for sensor in hits])
     # Iterate through the search results
-    for sensor in results["hits"]["hits"]:
-        # Retrieve additional sensor information from MongoDB using the sensor's ID
-        infoSensor =getInfoSensorMDB(mongodb_client, sensor["_source"]["id"])
+    for sensor in hits:
+        infoSensor = infos.get(sensor["_source"]["id"])
         if infoSensor:
             # Merge the Elasticsearch and MongoDB sensor data and add it to the sensors_data list
             sensor_data = {**{"id": sensor["_source"]["id"],"name": sensor["_source"]["name"]}, **(infoSensor)}
@@ -205,64 +315,214 @@ def searchElasticsearch(es: ElasticsearchClient, query_dict: dict ,search_type:
     return sensors_data
 
 
-def insert_sensor_data_to_timescale(sensor_id:int , data:schemas.SensorData, timescale:Timescale):
-    data_dict = {
-            "sensor_id": sensor_id,
-            "velocity": data.velocity if hasattr(data, 'velocity') else None,
-            "temperature": data.temperature if hasattr(data, 'temperature') else None,
-            "humidity": data.humidity if hasattr(data, 'humidity') else None,
-            "battery_level": data.battery_level,
-            "last_seen": data.last_seen 
-        }
-    columns = list(data_dict.keys())#[col for col in sensor_data if sensor_data[col] is not None]
-    placeholders = ["%s"] * len(columns)
-    values = [data_dict[col] for col in columns]
+# Readings are identified by (sensor_id, last_seen), a repeated one is ignored
+INSERT_SENSOR_DATA = """
+    INSERT INTO sensor_data (sensor_id, velocity, temperature, humidity, battery_level, last_seen)
+    VALUES ($1, $2, $3, $4, $5, $6)
+    ON CONFLICT (sensor_id, last_seen) DO NOTHING"""
+INSERT_SENSOR_DATA_TYPES = ["int", "double precision", "double precision", "double precision", "double precision", "timestamptz"]
 
-    query = f"""
-        INSERT INTO sensor_data ({', '.join(columns)})
-        VALUES ({', '.join(placeholders)})"""
+def insert_sensor_data_to_timescale(sensor_id:int , data:schemas.SensorData, timescale:Timescale):
+    values = [
+        sensor_id,
+        data.velocity if hasattr(data, 'velocity') else None,
+        data.temperature if hasattr(data, 'temperature') else None,
+        data.humidity if hasattr(data, 'humidity') else None,
+        data.battery_level,
+        data.last_seen,
+    ]
     try:    
         timescale.enable_autocommit(True)
-        timescale.execute(query, values)
+        timescale.execute_prepared("insert_sensor_data", INSERT_SENSOR_DATA, values, INSERT_SENSOR_DATA_TYPES)
         timescale.enable_autocommit(False)
         return {"message": "Data recorded successfully"}
     except Exception as e:
         timescale.enable_autocommit(False)
         raise HTTPException(status_code=500, detail="Failed to record sensor data")
     
+
+
+def insert_sensor_data_to_timescale_bulk(messages: List[schemas.SensorDataMessage], timescale: Timescale):
+    # COPY of the whole batch through a staging table, repeated readings are ignored
+    rows = [
+        (message.sensor_id, message.data.velocity, message.data.temperature, message.data.humidity, message.data.battery_level, message.data.last_seen)
+        for message in messages
+    ]
+    try:
+        return timescale.copy_rows("sensor_data", ["sensor_id", "velocity", "temperature", "humidity", "battery_level", "last_seen"],
+                                   rows, conflict_columns=["sensor_id", "last_seen"])
+    except Exception as e:
+        print(f"Error inserting data into Timescale: {str(e)}")
+        raise HTTPException(status_code=500, detail="Failed to record sensor data")
+
       
 def get_view_data(sensor_id:int, from_:str, to:str, bucket:str,timescale:Timescale):
+    """ Aggregates of the sensor in [from_, to], and the watermark of the view: the
+    buckets before it are materialized, the ones after it computed from the raw readings. """
     # Validate the bucket parameter to ensure it is one of the predefined sizes
-    if bucket not in ['hour', 'day', 'week', 'month', 'year']:
+    if bucket not in refresh.BUCKET_INTERVALS:
             raise HTTPException(status_code=400, detail="Invalid bucket size")
     view_name = f"{bucket}_aggregates"
     # Adjust the 'from_' date to the start of the week if the bucket size is 'week'
     if bucket == "week":
             from_date = datetime.fromisoformat(from_[:-1])  # Remove the 'Z'
             from_ = from_date - timedelta(days=from_date.weekday())
-    # Try to refresh the continuous aggregate view to ensure data is up to date
+    # Only late readings for already materialized buckets need a refresh, the rest of the
+    # window is served by real-time aggregation
     try:
-        now = datetime.now().isoformat(timespec='milliseconds')
-        timescale.enable_autocommit(True)
-        query_refresh = f"CALL refresh_continuous_aggregate('{view_name}', '2019-01-01T00:00:00.000Z', '{now}Z');"
-        timescale.execute(query_refresh)
+        watermark = refresh.ensure_fresh(timescale, bucket, from_, to)
     except Exception as e:
-            timescale.enable_autocommit(False)
             raise HTTPException(status_code=500, detail=f"Failed to refresh aggregate view: {str(e)}")
+    # One prepared statement per view, the bucket is checked against BUCKET_INTERVALS above
     query = f"""
-        SELECT *
+        SELECT sensor_id, {bucket}, avg_velocity, avg_temperature, avg_humidity, avg_battery
         FROM {view_name}
-        WHERE sensor_id = %s AND {bucket} BETWEEN %s AND %s; """
+        WHERE sensor_id = $1 AND {bucket} BETWEEN $2 AND $3"""
     try:
-        results = timescale.fetch_all(query, (sensor_id, from_, to))
-        timescale.enable_autocommit(False)
+        results = timescale.fetch_all_prepared(f"select_{view_name}", query, (sensor_id, from_, to), ["int", "timestamptz", "timestamptz"])
         if not results:
-            return []
-        return [dict(zip(["sensor_id", "time_bucket", "avg_velocity", "avg_temperature", "avg_humidity", "avg_battery"], result)) for result in results]
+            return [], watermark
+        return [dict(zip(["sensor_id", "time_bucket", "avg_velocity", "avg_temperature", "avg_humidity", "avg_battery"], result)) for result in results], watermark
     except Exception as e:
-        timescale.enable_autocommit(False)
         raise HTTPException(status_code=500, detail=f"Failed to fetch aggregated data: {str(e)}")
 
+# Metrics of the aggregate views, API name -> column suffix, and the aggregates computed
+# for each one
+AGGREGATE_METRICS = {
+    "velocity": "velocity",
+    "temperature": "temperature",
+    "humidity": "humidity",
+    "battery_level": "battery",
+}
+AGGREGATE_FUNCTIONS = ["avg", "min", "max", "count", "last"]
+
+def get_sensor_ids_by_type(cassandra_client, sensor_type: str) -> List[int]:
+    query = cassandra_client.prepare("SELECT sensor_id FROM sensor.sensor_counts WHERE sensor_type = ?")
+    return [row.sensor_id for row in cassandra_client.execute(query, (sensor_type,))]
+
+def get_aggregates(timescale: Timescale, sensor_ids: List[int], from_: str, to: str, bucket: str, metrics: List[str]):
+    """ Aggregates of several sensors and metrics in [from_, to] with a single query,
+    as columns: one list per field, with the rows ordered by sensor and bucket. """
+    if bucket not in refresh.BUCKET_INTERVALS:
+        raise HTTPException(status_code=400, detail="Invalid bucket size")
+    unknown = [metric for metric in metrics if metric not in AGGREGATE_METRICS]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown metrics: {', '.join(unknown)}")
+    watermark = refresh.ensure_fresh(timescale, bucket, from_, to)
+    columns = [f"{function}_{AGGREGATE_METRICS[metric]}" for metric in metrics for function in AGGREGATE_FUNCTIONS]
+    # The first bucket is the one containing from_, whatever the bucket size
+    query = f"""
+        SELECT sensor_id, {bucket}, {", ".join(columns)}
+        FROM {bucket}_aggregates
+        WHERE sensor_id = ANY(%s)
+          AND {bucket} >= time_bucket(%s::interval, %s::timestamptz) AND {bucket} <= %s
+        ORDER BY sensor_id, {bucket}"""
+    rows = timescale.fetch_all(query, (list(sensor_ids), refresh.BUCKET_INTERVALS[bucket], from_, to))
+    fields = list(zip(*rows)) if rows else [()] * (len(columns) + 2)
+    result = {
+        "bucket": bucket,
+        "watermark": watermark,
+        "sensor_id": list(fields[0]),
+        "time_bucket": list(fields[1]),
+    }
+    for index, metric in enumerate(metrics):
+        offset = 2 + index * len(AGGREGATE_FUNCTIONS)
+        result[metric] = {function: list(fields[offset + position]) for position, function in enumerate(AGGREGATE_FUNCTIONS)}
+    return result
+
+RAW_DATA_COLUMNS = ["sensor_id", "last_seen", "velocity", "temperature", "humidity", "battery_level"]
+RAW_EXPORT_FORMATS = {"ndjson": "application/x-ndjson", "csv": "text/csv"}
+
+def export_raw_data(timescale: Timescale, sensor_ids: List[int], from_: Optional[datetime], to: Optional[datetime], format: str):
+    """ Raw readings of the sensors in [from_, to], ordered by time, as NDJSON or CSV text
+    chunks of one cursor batch each. """
+    conditions = ["sensor_id = ANY(%s)"]
+    params = [list(sensor_ids)]
+    if from_:
+        conditions.append("last_seen >= %s")
+        params.append(from_)
+    if to:
+        conditions.append("last_seen <= %s")
+        params.append(to)
+    query = f"""
+        SELECT {", ".join(RAW_DATA_COLUMNS)}
+        FROM sensor_data
+        WHERE {" AND ".join(conditions)}
+        ORDER BY last_seen, sensor_id"""
+    if format == "csv":
+        yield ",".join(RAW_DATA_COLUMNS) + "\n"
+    for rows in timescale.stream(query, params):
+        if format == "csv":
+            buffer = io.StringIO()
+            csv.writer(buffer, lineterminator="\n").writerows(
+                (row[0], row[1].isoformat(), *row[2:]) for row in rows)
+            yield buffer.getvalue()
+        else:
+            yield "".join(json.dumps(dict(zip(RAW_DATA_COLUMNS, (row[0], row[1].isoformat(), *row[2:])))) + "\n"
+                          for row in rows)
+
+SERIES_METHODS = ["lttb", "minmax"]
+
+def _parse_time(value: str) -> datetime:
+    parsed = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    return parsed if parsed.tzinfo else parsed.replace(tzinfo=timezone.utc)
+
+def get_series(timescale: Timescale, sensor_id: int, metric: str, from_: str, to: str, points: int, method: str):
+    """ About points values of a metric of the sensor in [from_, to] for charting. They are
+    read from the coarsest aggregate view with at least points buckets in the range (raw
+    readings for short ranges) and downsampled with LTTB or min/max decimation. """
+    if metric not in AGGREGATE_METRICS:
+        raise HTTPException(status_code=400, detail=f"Unknown metric: {metric}")
+    if method not in SERIES_METHODS:
+        raise HTTPException(status_code=400, detail=f"Unsupported method: {method}")
+    try:
+        start, end = _parse_time(from_), _parse_time(to)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid from_ or to")
+    bucket = downsampling.pick_bucket((end - start).total_seconds(), points)
+    if bucket is None:
+        source = "sensor_data"
+        query = f"""
+            SELECT last_seen, {metric}, {metric}, {metric}
+            FROM sensor_data
+            WHERE sensor_id = %s AND last_seen BETWEEN %s AND %s AND {metric} IS NOT NULL
+            ORDER BY last_seen"""
+        params = (sensor_id, start, end)
+    else:
+        source = f"{bucket}_aggregates"
+        column = AGGREGATE_METRICS[metric]
+        refresh.ensure_fresh(timescale, bucket, start, end)
+        query = f"""
+            SELECT {bucket}, avg_{column}, min_{column}, max_{column}
+            FROM {source}
+            WHERE sensor_id = %s AND {bucket} >= time_bucket(%s::interval, %s::timestamptz) AND {bucket} <= %s
+              AND count_{column} > 0
+            ORDER BY {bucket}"""
+        params = (sensor_id, refresh.BUCKET_INTERVALS[bucket], start, end)
+    times, averages, lows, highs = [], [], [], []
+    for rows in timescale.stream(query, params):
+        columns = list(zip(*rows))
+        times.append(np.array([time.timestamp() for time in columns[0]]))
+        averages.append(np.array(columns[1], dtype=float))
+        lows.append(np.array(columns[2], dtype=float))
+        highs.append(np.array(columns[3], dtype=float))
+    x = np.concatenate(times) if times else np.empty(0)
+    if method == "lttb":
+        y = np.concatenate(averages) if averages else np.empty(0)
+        indexes = downsampling.lttb(x, y, points)
+        values = y[indexes]
+    else:
+        indexes, values = downsampling.minmax(np.concatenate(lows) if lows else np.empty(0),
+                                              np.concatenate(highs) if highs else np.empty(0), points)
+    return {
+        "sensor_id": sensor_id,
+        "metric": metric,
+        "source": source,
+        "method": method,
+        "time": [datetime.fromtimestamp(seconds, tz=timezone.utc).isoformat() for seconds in x[indexes]],
+        "value": values.tolist(),
+    }
+
 def get_temperature_values(db, cassandra_client, mongodb_client):
     try:
         result = cassandra_client.execute(
@@ -275,16 +535,16 @@ def get_temperature_values(db, cassandra_client, mongodb_client):
             temperature_data[row.sensor_id].append(row.temperature)
 
         response_data = {"sensors": []}
+        # Names and metadata of all the sensors with one query per store, sensors
+        # deleted since their readings were stored are left out
+        sensors = get_sensors_full(db, mongodb_client, temperature_data.keys())
         for sensor_id, temperatures in temperature_data.items():
-            if temperatures:
+            if temperatures and sensor_id in sensors:
                 max_temp = max(temperatures)
                 min_temp = min(temperatures)
                 avg_temp = sum(temperatures) / len(temperatures)
-                db_sensor = get_sensor(db, sensor_id)  # Supposing get_sensor is a function in this repository
-                infoSensor = getInfoSensorMDB(mongodb_client, sensor_id)  # Supposing getInfoSensorMDB is also here
                 response_data["sensors"].append({
-                    **{"id": sensor_id, "name": db_sensor.name},
-                    **(infoSensor),
+                    **sensors[sensor_id],
                     **{"values": [{
                         "max_temperature": max_temp,
                         "min_temperature": min_temp,
@@ -312,14 +572,14 @@ def get_low_battery_sensors(cassandra_client, db, mongodb_client):
         SELECT sensor_id, battery_level FROM sensor.sensors_low_battery
         WHERE battery_range = 'low'
         """
-        result = cassandra_client.execute(query)
+        result = list(cassandra_client.execute(query))
         response_data = {"sensors": []}
+        sensors = get_sensors_full(db, mongodb_client, [sensor.sensor_id for sensor in result])
         for sensor in result:
-            db_sensor = get_sensor(db, sensor.sensor_id)  
-            infoSensor = getInfoSensorMDB(mongodb_client, sensor.sensor_id) 
+            if sensor.sensor_id not in sensors:
+                continue
             response_data["sensors"].append({
-                **{"id": sensor.sensor_id, "name": db_sensor.name},
-                **(infoSensor),
+                **sensors[sensor.sensor_id],
                 **{"battery_level": sensor.battery_level}
             })
         return response_data
@@ -363,3 +623,31 @@ def insert_sensor_data_cassandra(cassandra_client, sensor_id, data):
     except Exception as e:
         print(f"Error inserting data into Cassandra: {str(e)}")
         raise
+
+
+def insert_sensor_data_cassandra_bulk(cassandra_client, messages: List[schemas.SensorDataMessage]):
+    # Same tables as insert_sensor_data_cassandra, sent as unlogged batches
+    statements = []
+    for message in messages:
+        sensor_id, data = message.sensor_id, message.data
+        if data.temperature is not None:
+            typeSensor = "Temperatura"
+            statements.append((
+                "INSERT INTO sensor.sensor_temperatures (sensor_id, temperature, last_seen) VALUES (?, ?, ?)",
+                (sensor_id, data.temperature, datetime.fromisoformat(data.last_seen.replace("Z", "+00:00")))
+            ))
+        else:
+            typeSensor = "Velocitat"
+            statements.append((
+                "INSERT INTO sensor.sensors_low_battery (battery_range, sensor_id, battery_level) VALUES (?, ?, ?)",
+                (classify_battery_level(data.battery_level), sensor_id, data.battery_level)
+            ))
+        statements.append((
+            "INSERT INTO sensor.sensor_counts (sensor_type, sensor_id) VALUES (?, ?)",
+            (typeSensor, sensor_id)
+        ))
+    try:
+        cassandra_client.execute_batch(statements)
+    except Exception as e:
+        print(f"Error inserting data into Cassandra: {str(e)}")
+        raise
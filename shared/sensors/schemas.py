@@ -37,3 +37,19 @@ class SensorData(BaseModel):
     humidity: float | None = None
     battery_level: float| None = None
     last_seen: str
+
+
+class SensorDataMessage(BaseModel):
+    sensor_id: int
+    data: SensorData
+
+    def to_json(self) -> str:
+        return self.json()
+
+
+class SensorDataRecord(SensorData):
+    # A reading of the bulk ingest endpoint, carrying the id of its sensor
+    sensor_id: int
+
+    def to_message(self) -> SensorDataMessage:
+        return SensorDataMessage(sensor_id=self.sensor_id, data=SensorData(**self.dict(exclude={"sensor_id"})))
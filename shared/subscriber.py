@@ -1,14 +1,17 @@
+import functools
 import pika
 import time
 
-from shared.publisher import QUEUE_NAME
+from shared import codec
+from shared.publisher import (RABBITMQ_HOST, RABBITMQ_PORT, RETRY_COUNT_HEADER, RETRY_MAX_ATTEMPTS,
+                              dead_letter_queue, declare_topology, legacy_sink_queue, retry_queue,
+                              shard_for, shard_queue)
 
 class Subscriber:
     def __init__(self):
         credentials = pika.PlainCredentials('guest', 'guest')
-        # Change the host to rabbitmq
-        parameters = pika.ConnectionParameters('localhost',
-                                       5672,
+        parameters = pika.ConnectionParameters(RABBITMQ_HOST,
+                                       RABBITMQ_PORT,
                                        '/',
                                        credentials)
         try:
@@ -17,14 +20,183 @@ class Subscriber:
             time.sleep(10)
             self.conn = pika.BlockingConnection(parameters)
         self.channel = self.conn.channel()
+        self.stopping = False
+        declare_topology(self.channel)
+        # Messages are only acked once they are written or safely moved to a retry queue
+        self.channel.confirm_delivery()
 
 
-    def subscribe(self, callback):
-        result = self.channel.queue_declare(queue=QUEUE_NAME)
-        self.channel.basic_consume(queue=QUEUE_NAME, on_message_callback=callback, auto_ack=True)
+    def subscribe(self, queue, callback):
+        # Messages are acked once the callback returns, and requeued if it raises
+        def on_message(ch, method, properties, body):
+            try:
+                callback(ch, method, properties, body)
+            except Exception as e:
+                print(f"Error processing message: {str(e)}")
+                ch.basic_nack(delivery_tag=method.delivery_tag, requeue=True)
+                return
+            ch.basic_ack(delivery_tag=method.delivery_tag)
+
+        self.channel.basic_consume(queue=queue, on_message_callback=on_message, auto_ack=False)
         self.channel.start_consuming()
 
+    def consume_batches(self, queues, handler, batch_size=500, batch_timeout=1.0, prefetch=1000):
+        """ Collect messages of the queues into batches of at most batch_size messages or
+        batch_timeout seconds and call handler(readings) with the readings decoded from each
+        batch. The batch is acked once the handler returns; if it raises, its messages are
+        moved to the retry queues and acked, so a failing message never blocks the queue.
+        prefetch should be at least batch_size. Returns after stop() is called, once the
+        batch in progress has been flushed. The queues are consumed exclusively, so the
+        messages of a queue are written in order by a single worker. """
+        self.channel.basic_qos(prefetch_count=prefetch)
+        batch = []
+        deadline = None
+
+        def on_message(queue, ch, method, properties, body):
+            nonlocal deadline
+            batch.append((method.delivery_tag, queue, properties, body))
+            # One process_data_events call may deliver up to prefetch messages, full
+            # batches are flushed as they fill up
+            if len(batch) >= batch_size:
+                self._flush(handler, batch)
+                batch.clear()
+                deadline = None
+
+        for queue in queues:
+            self.channel.basic_consume(queue=queue, on_message_callback=functools.partial(on_message, queue),
+                                       auto_ack=False, exclusive=True)
+        while not self.stopping:
+            time_limit = batch_timeout if deadline is None else max(deadline - time.monotonic(), 0)
+            self.conn.process_data_events(time_limit=time_limit)
+            if not batch:
+                continue
+            if deadline is None:
+                deadline = time.monotonic() + batch_timeout
+            if time.monotonic() >= deadline:
+                self._flush(handler, batch)
+                batch.clear()
+                deadline = None
+        # Drain: stop the deliveries and flush what was already received; prefetched
+        # messages that were not delivered yet are requeued by the broker on close
+        self.channel.stop_consuming()
+        if batch:
+            self._flush(handler, batch)
+            batch.clear()
+
+    def stop(self):
+        # Safe to call from a signal handler, the consume loop checks it between events
+        self.stopping = True
+
+    def _flush(self, handler, batch):
+        fresh = []
+        retried = []
+        for _, queue, properties, body in batch:
+            try:
+                readings = codec.decode(body, properties.content_type)
+            except Exception as e:
+                # A message that can't be decoded will never succeed
+                self._dead_letter(queue, properties, body, f"Undecodable message: {str(e)}")
+                continue
+            if (properties.headers or {}).get(RETRY_COUNT_HEADER):
+                retried.append((queue, properties, body, readings))
+            else:
+                fresh.append((queue, properties, body, readings))
+        if fresh:
+            try:
+                handler([reading for _, _, _, readings in fresh for reading in readings])
+            except Exception as e:
+                print(f"Error processing batch of {len(fresh)} messages: {str(e)}")
+                for queue, properties, body, _ in fresh:
+                    self._retry(queue, properties, body, str(e))
+        # Messages that already failed once are written one by one, so a poisoned
+        # message doesn't drag the rest of its batch into the retry queues again
+        for queue, properties, body, readings in retried:
+            try:
+                handler(readings)
+            except Exception as e:
+                self._retry(queue, properties, body, str(e))
+        # Delivery tags grow monotonically on a channel, so acking the last one with
+        # multiple=True settles the whole batch in a single frame
+        self.channel.basic_ack(delivery_tag=batch[-1][0], multiple=True)
+
+    def _retry(self, queue, properties, body, error):
+        attempt = (properties.headers or {}).get(RETRY_COUNT_HEADER, 0)
+        if attempt >= RETRY_MAX_ATTEMPTS:
+            self._dead_letter(queue, properties, body, error)
+            return
+        self._republish(retry_queue(queue, attempt), properties, body, {RETRY_COUNT_HEADER: attempt + 1, 'x-last-error': error})
+
+    def _dead_letter(self, queue, properties, body, error):
+        print(f"Moving message to {dead_letter_queue(queue)}: {error}")
+        self._republish(dead_letter_queue(queue), properties, body, {'x-last-error': error})
+
+    def _republish(self, routing_key, properties, body, headers):
+        properties = pika.BasicProperties(content_type=properties.content_type,
+                                          delivery_mode=pika.DeliveryMode.Persistent,
+                                          headers={**(properties.headers or {}), **headers})
+        # keep the error header small, it travels with every retried message
+        properties.headers['x-last-error'] = properties.headers.get('x-last-error', '')[:500]
+        self.channel.basic_publish(exchange='', routing_key=routing_key, body=body, properties=properties)
+
+    def replay_dead_letters(self, queue, limit=None):
+        """ Move the messages parked in the dead letter queue of queue back to it, with their
+        retry count reset. Returns the number of messages moved. At most the messages parked
+        when the replay starts are moved, so the ones that fail again while it runs wait for
+        the next replay instead of going round forever. """
+        parked = self.channel.queue_declare(queue=dead_letter_queue(queue), passive=True).method.message_count
+        limit = parked if limit is None else min(limit, parked)
+        moved = 0
+        while moved < limit:
+            method, properties, body = self.channel.basic_get(queue=dead_letter_queue(queue), auto_ack=False)
+            if method is None:
+                break
+            headers = {key: value for key, value in (properties.headers or {}).items() if key not in (RETRY_COUNT_HEADER, 'x-last-error')}
+            properties = pika.BasicProperties(content_type=properties.content_type,
+                                              delivery_mode=pika.DeliveryMode.Persistent,
+                                              headers=headers)
+            self.channel.basic_publish(exchange='', routing_key=queue, body=body, properties=properties)
+            self.channel.basic_ack(delivery_tag=method.delivery_tag)
+            moved += 1
+        return moved
+
+    def move_legacy_messages(self, sink):
+        """ Move the readings left in the pre-shard queue of the sink, and in its dead letter
+        queue, to the shard queues of the sink. Returns the number of messages moved. """
+        moved = 0
+        for queue in (legacy_sink_queue(sink), dead_letter_queue(legacy_sink_queue(sink))):
+            moved += self._move_legacy_queue(sink, queue)
+        return moved
+
+    def _move_legacy_queue(self, sink, queue):
+        moved = 0
+        while True:
+            try:
+                method, properties, body = self.channel.basic_get(queue=queue, auto_ack=False)
+            except pika.exceptions.ChannelClosedByBroker:
+                # The queue never existed on this broker
+                self.channel = self.conn.channel()
+                self.channel.confirm_delivery()
+                break
+            if method is None:
+                break
+            try:
+                readings = codec.decode(body, properties.content_type)
+            except Exception as e:
+                self._dead_letter(shard_queue(sink, 0), properties, body, f"Undecodable message: {str(e)}")
+                readings = []
+            shards = {}
+            for reading in readings:
+                shards.setdefault(shard_for(reading.sensor_id), []).append(reading)
+            for shard, readings in shards.items():
+                self.channel.basic_publish(exchange='', routing_key=shard_queue(sink, shard),
+                                           body=codec.encode(readings, properties.content_type or codec.JSON_CONTENT_TYPE),
+                                           properties=pika.BasicProperties(content_type=properties.content_type,
+                                                                           delivery_mode=pika.DeliveryMode.Persistent))
+            self.channel.basic_ack(delivery_tag=method.delivery_tag)
+            moved += 1
+        return moved
+
     def close(self):
         self.conn.close()
 
-    
\ No newline at end of file
+    
@@ -1,15 +1,47 @@
-import psycopg2
+import csv
+import io
 import os
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+import psycopg2
+from psycopg2 import extensions, pool, sql
+
+# Process-wide pool of Timescale connections. Checkouts block up to TS_POOL_TIMEOUT seconds
+# when all TS_POOL_MAX connections are in use. A connection idle for more than
+# TS_POOL_CHECK_AFTER seconds is checked with a SELECT 1 before being handed out.
+TS_POOL_MIN = int(os.environ.get("TS_POOL_MIN", "1"))
+TS_POOL_MAX = int(os.environ.get("TS_POOL_MAX", "10"))
+TS_POOL_TIMEOUT = float(os.environ.get("TS_POOL_TIMEOUT", "10"))
+TS_POOL_CHECK_AFTER = float(os.environ.get("TS_POOL_CHECK_AFTER", "30"))
+# Rows fetched per round trip by Timescale.stream
+TS_STREAM_ITERSIZE = int(os.environ.get("TS_STREAM_ITERSIZE", "2000"))
+
+
+def connection_kwargs():
+    return {
+        "host": os.environ.get("TS_HOST"),
+        "port": os.environ.get("TS_PORT"),
+        "user": os.environ.get("TS_USER"),
+        "password": os.environ.get("TS_PASSWORD"),
+        "database": os.environ.get("TS_DBNAME"),
+    }
+
+
+class PreparedConnection(extensions.connection):
+    """ Connection that remembers the statements prepared in its session. """
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.prepared = set()
 
 
 class Timescale:
-    def __init__(self):
-        self.conn = psycopg2.connect(
-            host=os.environ.get("TS_HOST"),
-            port=os.environ.get("TS_PORT"),
-            user=os.environ.get("TS_USER"),
-            password=os.environ.get("TS_PASSWORD"),
-            database=os.environ.get("TS_DBNAME"))
+    def __init__(self, conn=None):
+        # Without conn the client opens, and closes, its own connection
+        self.pooled = conn is not None
+        self.conn = conn if conn is not None else psycopg2.connect(connection_factory=PreparedConnection, **connection_kwargs())
         self.cursor = self.conn.cursor()
         
     def getCursor(self):
@@ -21,7 +53,8 @@ class Timescale:
 
     def close(self):
         self.cursor.close()
-        self.conn.close()
+        if not self.pooled:
+            self.conn.close()
     
     def ping(self):
         return self.conn.ping()
@@ -29,6 +62,62 @@ class Timescale:
     def execute(self, query,  params=None):
        return self.cursor.execute(query, params)
         
+    def execute_prepared(self, name, query, params=(), types=None):
+        """ Execute query as the prepared statement name, preparing it the first time it is
+        used on the connection. The query takes $1, $2... parameters, of the given types or
+        inferred by the server. Statements stay prepared as long as the connection. """
+        # Plain psycopg2 connections keep no registry and check the session every time
+        prepared = getattr(self.conn, "prepared", set())
+        if name not in prepared:
+            self.cursor.execute("SELECT 1 FROM pg_prepared_statements WHERE name = %s", (name,))
+            if self.cursor.fetchone() is None:
+                self.cursor.execute(sql.SQL("PREPARE {} {} AS {}").format(
+                    sql.Identifier(name),
+                    sql.SQL("({})".format(", ".join(types))) if types else sql.SQL(""),
+                    sql.SQL(query)))
+            prepared.add(name)
+        if params:
+            self.cursor.execute(sql.SQL("EXECUTE {} ({})").format(
+                sql.Identifier(name), sql.SQL(", ").join(sql.Placeholder() * len(params))), params)
+        else:
+            self.cursor.execute(sql.SQL("EXECUTE {}").format(sql.Identifier(name)))
+
+    def fetch_all_prepared(self, name, query, params=(), types=None):
+        self.execute_prepared(name, query, params, types)
+        return self.cursor.fetchall()
+
+    def copy_rows(self, table, columns, rows, conflict_columns):
+        """ Bulk insert rows with COPY and commit them. The rows are streamed as CSV into a
+        temporary staging table and merged into the table skipping the ones that already
+        exist (same conflict_columns). Returns the number of rows inserted. """
+        buffer = io.StringIO()
+        csv.writer(buffer, lineterminator="\n").writerows(rows)
+        buffer.seek(0)
+        staging = sql.Identifier(f"{table}_staging")
+        column_list = sql.SQL(", ").join(map(sql.Identifier, columns))
+        # The staging table is emptied on commit, so the three statements must share one
+        # transaction even on a connection left in autocommit
+        autocommit = self.conn.autocommit
+        if autocommit:
+            self.conn.autocommit = False
+        try:
+            # The staging table lives as long as the connection and is emptied on commit
+            self.cursor.execute(sql.SQL("CREATE TEMP TABLE IF NOT EXISTS {} (LIKE {} INCLUDING DEFAULTS) ON COMMIT DELETE ROWS").format(
+                staging, sql.Identifier(table)))
+            self.cursor.copy_expert(sql.SQL("COPY {} ({}) FROM STDIN WITH (FORMAT csv)").format(staging, column_list), buffer)
+            self.cursor.execute(sql.SQL("INSERT INTO {} ({}) SELECT {} FROM {} ON CONFLICT ({}) DO NOTHING").format(
+                sql.Identifier(table), column_list, column_list, staging,
+                sql.SQL(", ").join(map(sql.Identifier, conflict_columns))))
+            inserted = self.cursor.rowcount
+            self.conn.commit()
+            return inserted
+        except Exception:
+            self.conn.rollback()
+            raise
+        finally:
+            if autocommit:
+                self.conn.autocommit = True
+
     def fetch_all(self, query, params=None):
         self.cursor.execute(query, params)
         return self.cursor.fetchall()
@@ -37,6 +126,101 @@ class Timescale:
         self.cursor.execute(query, params)
         return self.cursor.fetchone() 
     
+    def stream(self, query, params=None, itersize=TS_STREAM_ITERSIZE):
+        """ Yield the rows of the query in lists of up to itersize rows. They are read through
+        a named (server-side) cursor, so only one batch is held in memory whatever the size of
+        the result. The cursor lives in the open transaction, the caller ends it. """
+        with self.conn.cursor(name=f"stream_{uuid.uuid4().hex}") as cursor:
+            cursor.itersize = itersize
+            cursor.execute(query, params)
+            while True:
+                rows = cursor.fetchmany(itersize)
+                if not rows:
+                    break
+                yield rows
+
     def delete(self, table):
         self.cursor.execute("DELETE FROM " + table)
-        self.conn.commit()
\ No newline at end of file
+        self.conn.commit()
+
+
+class TimescalePool:
+    def __init__(self, minconn=TS_POOL_MIN, maxconn=TS_POOL_MAX):
+        self._pool = pool.ThreadedConnectionPool(minconn, maxconn, connection_factory=PreparedConnection, **connection_kwargs())
+        # ThreadedConnectionPool fails right away when it is exhausted, the semaphore makes
+        # the callers wait for a connection instead
+        self._slots = threading.BoundedSemaphore(maxconn)
+        self._last_used = {}
+
+    @contextmanager
+    def connection(self):
+        """ Borrow a connection wrapped in a Timescale client, returned to the pool on exit. """
+        if not self._slots.acquire(timeout=TS_POOL_TIMEOUT):
+            raise pool.PoolError("No Timescale connection available")
+        try:
+            conn = self._checkout()
+            timescale = Timescale(conn=conn)
+            try:
+                yield timescale
+            finally:
+                timescale.close()
+                self._checkin(conn)
+        finally:
+            self._slots.release()
+
+    def _checkout(self):
+        # Several idle connections may have gone stale together (e.g. after a database
+        # restart), so they are discarded until a healthy one turns up
+        deadline = time.monotonic() + TS_POOL_TIMEOUT
+        while True:
+            conn = self._pool.getconn()
+            if self._healthy(conn):
+                return conn
+            self._last_used.pop(id(conn), None)
+            self._pool.putconn(conn, close=True)
+            if time.monotonic() >= deadline:
+                raise pool.PoolError("No healthy Timescale connection available")
+
+    def _healthy(self, conn):
+        if conn.closed:
+            return False
+        if time.monotonic() - self._last_used.get(id(conn), 0) < TS_POOL_CHECK_AFTER:
+            return True
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute("SELECT 1")
+            conn.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+    def _checkin(self, conn):
+        # Leave the connection as a fresh one: no open transaction and autocommit off
+        broken = bool(conn.closed)
+        if not broken:
+            try:
+                if conn.info.transaction_status != extensions.TRANSACTION_STATUS_IDLE:
+                    conn.rollback()
+                conn.autocommit = False
+            except psycopg2.Error:
+                broken = True
+        if broken:
+            self._last_used.pop(id(conn), None)
+        else:
+            self._last_used[id(conn)] = time.monotonic()
+        self._pool.putconn(conn, close=broken)
+
+    def close(self):
+        self._pool.closeall()
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+def get_pool() -> TimescalePool:
+    # Created on first use so importing this module never connects
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = TimescalePool()
+        return _pool
@@ -6,13 +6,35 @@ SELECT
   sensor_id,
   time_bucket( INTERVAL '1 hour', last_seen) AS hour,
   AVG(velocity) AS avg_velocity,
+  MIN(velocity) AS min_velocity,
+  MAX(velocity) AS max_velocity,
+  COUNT(velocity) AS count_velocity,
+  last(velocity, last_seen) AS last_velocity,
   AVG(temperature) AS avg_temperature,
+  MIN(temperature) AS min_temperature,
+  MAX(temperature) AS max_temperature,
+  COUNT(temperature) AS count_temperature,
+  last(temperature, last_seen) AS last_temperature,
   AVG(humidity) AS avg_humidity,
-  AVG(battery_level) AS avg_battery
+  MIN(humidity) AS min_humidity,
+  MAX(humidity) AS max_humidity,
+  COUNT(humidity) AS count_humidity,
+  last(humidity, last_seen) AS last_humidity,
+  AVG(battery_level) AS avg_battery,
+  MIN(battery_level) AS min_battery,
+  MAX(battery_level) AS max_battery,
+  COUNT(battery_level) AS count_battery,
+  last(battery_level, last_seen) AS last_battery
 FROM 
   sensor_data
 GROUP BY 
-  sensor_id, hour; 
+  sensor_id, hour;
+
+-- Real-time aggregation: buckets past the watermark are computed from sensor_data
+ALTER MATERIALIZED VIEW hour_aggregates SET (timescaledb.materialized_only = false);
+
+-- Re-added so that changes of the schedule reach existing databases
+SELECT remove_continuous_aggregate_policy('hour_aggregates', if_exists => true);
 
 SELECT add_continuous_aggregate_policy('hour_aggregates',
   start_offset => NULL,   
@@ -27,14 +49,36 @@ SELECT
   sensor_id,
   time_bucket( '1 day', last_seen) AS day,
   AVG(velocity) AS avg_velocity,
+  MIN(velocity) AS min_velocity,
+  MAX(velocity) AS max_velocity,
+  COUNT(velocity) AS count_velocity,
+  last(velocity, last_seen) AS last_velocity,
   AVG(temperature) AS avg_temperature,
+  MIN(temperature) AS min_temperature,
+  MAX(temperature) AS max_temperature,
+  COUNT(temperature) AS count_temperature,
+  last(temperature, last_seen) AS last_temperature,
   AVG(humidity) AS avg_humidity,
-  AVG(battery_level) AS avg_battery
+  MIN(humidity) AS min_humidity,
+  MAX(humidity) AS max_humidity,
+  COUNT(humidity) AS count_humidity,
+  last(humidity, last_seen) AS last_humidity,
+  AVG(battery_level) AS avg_battery,
+  MIN(battery_level) AS min_battery,
+  MAX(battery_level) AS max_battery,
+  COUNT(battery_level) AS count_battery,
+  last(battery_level, last_seen) AS last_battery
 FROM 
   sensor_data
 GROUP BY 
   sensor_id, day;
 
+-- Real-time aggregation: buckets past the watermark are computed from sensor_data
+ALTER MATERIALIZED VIEW day_aggregates SET (timescaledb.materialized_only = false);
+
+-- Re-added so that changes of the schedule reach existing databases
+SELECT remove_continuous_aggregate_policy('day_aggregates', if_exists => true);
+
 SELECT add_continuous_aggregate_policy('day_aggregates',
   start_offset => NULL,   
   end_offset => INTERVAL '1 h',      
@@ -48,14 +92,36 @@ SELECT
   sensor_id,
   time_bucket('1 week', last_seen) AS week,
   AVG(velocity) AS avg_velocity,
+  MIN(velocity) AS min_velocity,
+  MAX(velocity) AS max_velocity,
+  COUNT(velocity) AS count_velocity,
+  last(velocity, last_seen) AS last_velocity,
   AVG(temperature) AS avg_temperature,
+  MIN(temperature) AS min_temperature,
+  MAX(temperature) AS max_temperature,
+  COUNT(temperature) AS count_temperature,
+  last(temperature, last_seen) AS last_temperature,
   AVG(humidity) AS avg_humidity,
-  AVG(battery_level) AS avg_battery
+  MIN(humidity) AS min_humidity,
+  MAX(humidity) AS max_humidity,
+  COUNT(humidity) AS count_humidity,
+  last(humidity, last_seen) AS last_humidity,
+  AVG(battery_level) AS avg_battery,
+  MIN(battery_level) AS min_battery,
+  MAX(battery_level) AS max_battery,
+  COUNT(battery_level) AS count_battery,
+  last(battery_level, last_seen) AS last_battery
 FROM 
   sensor_data
 GROUP BY 
   sensor_id, week;
 
+-- Real-time aggregation: buckets past the watermark are computed from sensor_data
+ALTER MATERIALIZED VIEW week_aggregates SET (timescaledb.materialized_only = false);
+
+-- Re-added so that changes of the schedule reach existing databases
+SELECT remove_continuous_aggregate_policy('week_aggregates', if_exists => true);
+
 SELECT add_continuous_aggregate_policy('week_aggregates',
   start_offset => NULL,   
   end_offset => INTERVAL '1 h',      
@@ -69,14 +135,36 @@ SELECT
   sensor_id,
   time_bucket('1 month', last_seen) AS month,
   AVG(velocity) AS avg_velocity,
+  MIN(velocity) AS min_velocity,
+  MAX(velocity) AS max_velocity,
+  COUNT(velocity) AS count_velocity,
+  last(velocity, last_seen) AS last_velocity,
   AVG(temperature) AS avg_temperature,
+  MIN(temperature) AS min_temperature,
+  MAX(temperature) AS max_temperature,
+  COUNT(temperature) AS count_temperature,
+  last(temperature, last_seen) AS last_temperature,
   AVG(humidity) AS avg_humidity,
-  AVG(battery_level) AS avg_battery
+  MIN(humidity) AS min_humidity,
+  MAX(humidity) AS max_humidity,
+  COUNT(humidity) AS count_humidity,
+  last(humidity, last_seen) AS last_humidity,
+  AVG(battery_level) AS avg_battery,
+  MIN(battery_level) AS min_battery,
+  MAX(battery_level) AS max_battery,
+  COUNT(battery_level) AS count_battery,
+  last(battery_level, last_seen) AS last_battery
 FROM 
   sensor_data
 GROUP BY 
   sensor_id, month;
 
+-- Real-time aggregation: buckets past the watermark are computed from sensor_data
+ALTER MATERIALIZED VIEW month_aggregates SET (timescaledb.materialized_only = false);
+
+
+-- Re-added so that changes of the schedule reach existing databases
+SELECT remove_continuous_aggregate_policy('month_aggregates', if_exists => true);
 
 SELECT add_continuous_aggregate_policy('month_aggregates',
   start_offset => NULL,   
@@ -92,15 +180,37 @@ SELECT
   sensor_id,
   time_bucket('1 year', last_seen) AS year,
   AVG(velocity) AS avg_velocity,
+  MIN(velocity) AS min_velocity,
+  MAX(velocity) AS max_velocity,
+  COUNT(velocity) AS count_velocity,
+  last(velocity, last_seen) AS last_velocity,
   AVG(temperature) AS avg_temperature,
+  MIN(temperature) AS min_temperature,
+  MAX(temperature) AS max_temperature,
+  COUNT(temperature) AS count_temperature,
+  last(temperature, last_seen) AS last_temperature,
   AVG(humidity) AS avg_humidity,
-  AVG(battery_level) AS avg_battery
+  MIN(humidity) AS min_humidity,
+  MAX(humidity) AS max_humidity,
+  COUNT(humidity) AS count_humidity,
+  last(humidity, last_seen) AS last_humidity,
+  AVG(battery_level) AS avg_battery,
+  MIN(battery_level) AS min_battery,
+  MAX(battery_level) AS max_battery,
+  COUNT(battery_level) AS count_battery,
+  last(battery_level, last_seen) AS last_battery
 FROM 
   sensor_data
 GROUP BY 
   sensor_id, year;
 
+-- Real-time aggregation: buckets past the watermark are computed from sensor_data
+ALTER MATERIALIZED VIEW year_aggregates SET (timescaledb.materialized_only = false);
+
+-- Re-added so that changes of the schedule reach existing databases
+SELECT remove_continuous_aggregate_policy('year_aggregates', if_exists => true);
+
 SELECT add_continuous_aggregate_policy('year_aggregates',
   start_offset => NULL,   
   end_offset => INTERVAL '1 h',      
-  schedule_interval => INTERVAL '1 year'); 
\ No newline at end of file
+  schedule_interval => INTERVAL '1 day'); 
\ No newline at end of file